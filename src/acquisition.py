@@ -0,0 +1,265 @@
+import sys
+import time
+import argparse
+import threading
+import numpy as np
+
+class SampleRingBuffer:
+    """
+    Preallocated ring buffer of (timestamp, value) samples shared by one producer and
+    one consumer thread. If the consumer falls more than a full buffer behind, the
+    oldest unread samples are overwritten and counted as overruns.
+    """
+
+    def __init__(self, capacity):
+        """
+        :param capacity: Maximum number of unread samples held by the buffer.
+        """
+        self.capacity = capacity
+        self._samples = np.zeros((capacity, 2), dtype=np.int64)
+        self._lock = threading.Lock()
+
+        # Absolute number of samples written and read so far
+        self.written = 0
+        self.read = 0
+        self.overruns = 0
+
+    def write(self, samples):
+        """
+        Appends samples to the buffer.
+
+        :param samples: Array of shape (n, 2) with timestamps and values.
+        """
+        samples = np.asarray(samples, dtype=np.int64).reshape(-1, 2)
+
+        # Only the newest capacity samples of an oversized batch can be kept
+        if len(samples) > self.capacity:
+            samples = samples[-self.capacity:]
+
+        with self._lock:
+            positions = np.arange(self.written, self.written + len(samples)) % self.capacity
+            self._samples[positions] = samples
+            self.written += len(samples)
+
+            # Drop what the consumer can no longer read
+            if self.written - self.read > self.capacity:
+                self.overruns += self.written - self.read - self.capacity
+                self.read = self.written - self.capacity
+
+    def drain(self):
+        """
+        Removes and returns every unread sample.
+
+        :return: Array of shape (n, 2) with timestamps and values, oldest first.
+        """
+        with self._lock:
+            positions = np.arange(self.read, self.written) % self.capacity
+            samples = self._samples[positions]
+            self.read = self.written
+
+        return samples
+
+def parse_frames(data):
+    """
+    Parses the complete 'timestamp,value' lines of a block of bytes received from the
+    ESP32 (see PPG_V3.ino).
+
+    :param data: Received bytes; the last line may be incomplete.
+    :return: Tuple containing the parsed samples as an (n, 2) array, the number of
+             malformed lines and the trailing incomplete bytes.
+    """
+    lines = data.split(b"\n")
+    remainder = lines.pop()
+    samples = []
+    bad_frames = 0
+
+    for line in lines:
+        line = line.strip()
+
+        if not line:
+            continue
+
+        try:
+            timestamp, value = line.split(b",")
+            samples.append((int(timestamp), int(value)))
+        except ValueError:
+            bad_frames += 1
+
+    return np.array(samples, dtype=np.int64).reshape(-1, 2), bad_frames, remainder
+
+class SerialReader(threading.Thread):
+    """
+    Background thread that reads a serial port in bulk, parses the frames and stores the
+    samples in a SampleRingBuffer. Reads block on the port timeout instead of polling,
+    and malformed frames are counted and skipped.
+    """
+
+    def __init__(self, serial_port, ring_buffer, read_size=4096):
+        """
+        :param serial_port: Open pyserial port (or compatible object) with a read timeout.
+        :param ring_buffer: SampleRingBuffer that receives the samples.
+        :param read_size: Maximum number of bytes requested per read.
+        """
+        super().__init__(daemon=True)
+        self.serial_port = serial_port
+        self.ring_buffer = ring_buffer
+        self.read_size = read_size
+        self.frames = 0
+        self.bad_frames = 0
+        self.last_data_time = None
+        self.error = None
+        self._stop_event = threading.Event()
+
+    def stop(self):
+        """
+        Asks the thread to finish after its current read.
+        """
+        self._stop_event.set()
+
+    def run(self):
+        remainder = b""
+
+        while not self._stop_event.is_set():
+
+            # Block until data arrives or the port timeout expires, then take everything waiting
+            try:
+                data = self.serial_port.read(min(max(self.serial_port.in_waiting, 1), self.read_size))
+            except Exception as error:
+                self.error = error
+                break
+
+            if not data:
+                continue
+
+            self.last_data_time = time.monotonic()
+            samples, bad_frames, remainder = parse_frames(remainder + data)
+
+            # Keep a runaway line without newline from growing forever
+            if len(remainder) > self.read_size:
+                remainder = b""
+                bad_frames += 1
+
+            self.frames += len(samples) + bad_frames
+            self.bad_frames += bad_frames
+
+            if len(samples) > 0:
+                self.ring_buffer.write(samples)
+
+class BatchWriter(threading.Thread):
+    """
+    Background thread that periodically drains a SampleRingBuffer and appends the samples
+    to a file in the 'timestamp : value' format read by atractor_v10.py.
+    """
+
+    def __init__(self, ring_buffer, file_path, flush_interval=1.0):
+        """
+        :param ring_buffer: SampleRingBuffer to drain.
+        :param file_path: Output file, overwritten when the writer starts.
+        :param flush_interval: Seconds between flushes.
+        """
+        super().__init__(daemon=True)
+        self.ring_buffer = ring_buffer
+        self.file_path = file_path
+        self.flush_interval = flush_interval
+        self.samples_written = 0
+        self._stop_event = threading.Event()
+
+    def stop(self):
+        """
+        Asks the thread to write the remaining samples and finish.
+        """
+        self._stop_event.set()
+
+    def flush(self, file):
+        samples = self.ring_buffer.drain()
+
+        if len(samples) > 0:
+            file.write("".join(f"{timestamp} : {value}\n" for timestamp, value in samples.tolist()))
+            file.flush()
+            self.samples_written += len(samples)
+
+    def run(self):
+
+        with open(self.file_path, "w") as file:
+
+            while not self._stop_event.wait(self.flush_interval):
+                self.flush(file)
+
+            # Final flush after the reader has stopped
+            self.flush(file)
+
+def capture(command, serial_port, file_path, duration=180, idle_timeout=2.0, start_timeout=30.0, buffer_capacity=65536, flush_interval=1.0, read_timeout=0.1):
+    """
+    Sends a command ('ECG' or 'PPG') to the ESP32 and records its samples to a file.
+    A SerialReader fills a ring buffer in the background while a BatchWriter flushes it
+    to disk. The capture ends after duration seconds, or earlier once the stream has
+    been silent for idle_timeout seconds.
+
+    :param command: Command sent to the ESP32.
+    :param serial_port: Open pyserial port.
+    :param file_path: Output file in the 'timestamp : value' format.
+    :param duration: Maximum capture time in seconds, counted from the first data.
+    :param idle_timeout: Seconds without data after which the capture ends.
+    :param start_timeout: Seconds to wait for the first data.
+    :param buffer_capacity: Number of samples held by the ring buffer.
+    :param flush_interval: Seconds between writes to disk.
+    :param read_timeout: Timeout of each blocking serial read in seconds.
+    :return: Dictionary with the number of samples, frames, malformed frames and overruns.
+    """
+    serial_port.timeout = read_timeout
+    ring_buffer = SampleRingBuffer(buffer_capacity)
+    reader = SerialReader(serial_port, ring_buffer)
+    writer = BatchWriter(ring_buffer, file_path, flush_interval)
+
+    reader.start()
+    writer.start()
+    serial_port.write(command.encode())
+
+    # Wait for the data to begin
+    request_time = time.monotonic()
+
+    while reader.last_data_time is None and reader.is_alive() and time.monotonic() - request_time < start_timeout:
+        time.sleep(read_timeout)
+
+    start_time = time.monotonic()
+
+    while reader.last_data_time is not None and reader.is_alive():
+        now = time.monotonic()
+
+        if now - start_time >= duration or now - reader.last_data_time >= idle_timeout:
+            break
+
+        time.sleep(read_timeout)
+
+    reader.stop()
+    reader.join()
+    writer.stop()
+    writer.join()
+
+    if reader.error is not None:
+        raise reader.error
+
+    return {
+        "samples": writer.samples_written,
+        "frames": reader.frames,
+        "bad_frames": reader.bad_frames,
+        "overruns": ring_buffer.overruns,
+    }
+
+if __name__ == "__main__":
+
+    import serial
+
+    parser = argparse.ArgumentParser(description="Record ECG or PPG samples from the ESP32.")
+    parser.add_argument("port", help="Serial port, e.g. COM4, /dev/ttyUSB0 or the pty printed by esp32_simulator.py.")
+    parser.add_argument("command", choices=["ECG", "PPG"], help="Signal to record.")
+    parser.add_argument("output", help="Output file in the 'timestamp : value' format.")
+    parser.add_argument("--baud", type=int, default=115200, help="Baud rate (default: 115200).")
+    parser.add_argument("--duration", type=float, default=180, help="Maximum capture time in seconds.")
+    arguments = parser.parse_args()
+
+    with serial.Serial(arguments.port, arguments.baud) as serial_port:
+        statistics = capture(arguments.command, serial_port, arguments.output, arguments.duration)
+
+    print(f"Samples: {statistics['samples']} --- Bad frames: {statistics['bad_frames']} --- Overruns: {statistics['overruns']}")
+    sys.exit(0 if statistics["samples"] > 0 else 1)
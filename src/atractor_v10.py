@@ -1,40 +1,172 @@
 import os
+import sys
+import json
 import math
-import nolds
 import numpy as np
-import matplotlib.pyplot as plt
-from mpl_toolkits.mplot3d import Axes3D
-from sklearn.neighbors import NearestNeighbors
+from numpy.lib.stride_tricks import sliding_window_view
+from concurrent.futures import ThreadPoolExecutor
+from stage_cache import fingerprint_samples
+import instrumentation
+from instrumentation import instrumented
 
 def read_data_from_file(file_path):
     """
     Reads data from a specified file and returns a NumPy array of values.
 
     The file is expected to have lines formatted as 'timestamp : value',
-    where 'timestamp' is a string and 'value' is a float.
+    where 'timestamp' is a number and 'value' is a float. Every line is kept,
+    including repeated timestamps. Parsing goes through load_recording and
+    its binary cache.
 
     :param file_path: Path to the file for reading data.
     :return: NumPy array of data values.
     """
-    # Initialize an empty dictionary to store the data
-    data = {}
+    timestamps, values = load_recording(file_path)
 
-    # Open the file in read mode
+    return values
+
+def recording_cache_paths(file_path):
+    """
+    Returns the sidecar cache paths of a recording. The cache lives in a '.cache'
+    directory next to the recording: '<name>.npy' holds a (2, N) float64 array with
+    the timestamps in row 0 and the values in row 1, and '<name>.json' the size and
+    modification time of the source it was built from.
+
+    :param file_path: Path to the recording.
+    :return: Tuple containing the array path and the metadata path.
+    """
+    cache_directory = os.path.join(os.path.dirname(file_path), ".cache")
+    base_name = os.path.basename(file_path)
+
+    return os.path.join(cache_directory, f"{base_name}.npy"), os.path.join(cache_directory, f"{base_name}.json")
+
+def parse_recording_text(text, file_path):
+    """
+    Parses whole 'timestamp : value' lines into timestamp and value arrays.
+
+    :param text: Text of complete lines, e.g. a whole recording or a block of its lines.
+    :param file_path: Path to the recording, for the error messages.
+    :return: Tuple containing the timestamps and values as float64 arrays.
+    :raises ValueError: If the text holds no samples or a line is not 'timestamp : value'.
+    """
+    tokens = text.split()
+
+    if not tokens:
+        raise ValueError(f"{file_path} holds no 'timestamp : value' samples")
+
+    try:
+
+        # Fast path: every line is exactly 'timestamp : value'
+        if len(tokens) % 3 == 0 and all(separator == ":" for separator in tokens[1::3]):
+            return np.array(tokens[0::3], dtype=np.float64), np.array(tokens[2::3], dtype=np.float64)
+
+        # Fall back to splitting line by line for irregular spacing
+        rows = [line.strip().split(" : ") for line in text.split("\n") if line.strip()]
+
+        if any(len(row) != 2 for row in rows):
+            raise ValueError("a line is not 'timestamp : value'")
+
+        return np.array([row[0] for row in rows], dtype=np.float64), np.array([row[1] for row in rows], dtype=np.float64)
+
+    except ValueError as error:
+        raise ValueError(f"{file_path} is not a 'timestamp : value' recording: {error}") from error
+
+@instrumented
+def parse_recording(file_path):
+    """
+    Parses a whole 'timestamp : value' recording at once into timestamp and value arrays.
+
+    :param file_path: Path to the recording.
+    :return: Tuple containing the timestamps and values as float64 arrays.
+    :raises ValueError: If the file holds no samples or a line is not 'timestamp : value'.
+    """
+    # Read the whole file at once
     with open(file_path, "r") as file:
+        text = file.read()
 
-        # Iterate over each line in the file
-        for line in file:
+    return parse_recording_text(text, file_path)
+
+def recording_signature(file_path):
+    """
+    Describes the version of a recording the binary cache was built from.
+
+    :param file_path: Path to the recording.
+    :return: Dictionary with the size and modification time of the file.
+    """
+    source_status = os.stat(file_path)
+
+    return {"size": source_status.st_size, "mtime_ns": source_status.st_mtime_ns}
+
+def recording_cache_is_current(file_path):
+    """
+    Tells whether the binary cache of a recording exists and matches the text file.
+
+    :param file_path: Path to the recording.
+    :return: True if the cache can be loaded instead of parsing the file.
+    """
+    cache_path, metadata_path = recording_cache_paths(file_path)
+
+    if not (os.path.exists(cache_path) and os.path.exists(metadata_path)):
+        return False
+
+    with open(metadata_path, "r") as metadata_file:
+        try:
+            cached_signature = json.load(metadata_file)
+        except ValueError:
+            return False
 
-            # Split the line into timestamp and value, removing whitespace
-            timestamp, value = line.strip().split(" : ")
+    return cached_signature == recording_signature(file_path)
 
-            # Convert the value to float and store it in the dictionary with the timestamp as the key
-            data[timestamp] = float(value)
+@instrumented
+def load_recording(file_path, use_cache=True, mmap_mode=None):
+    """
+    Loads a 'timestamp : value' recording into timestamp and value arrays. The parsed
+    arrays are stored in a binary sidecar cache (see recording_cache_paths) that is
+    reused until the size or modification time of the source file changes.
+
+    :param file_path: Path to the recording.
+    :param use_cache: If False, always parses the text file and leaves the cache untouched.
+    :param mmap_mode: Optional; passed to np.load (e.g. 'r') to memory-map the cached arrays.
+    :return: Tuple containing the timestamps and values as float64 arrays.
+    """
+    cache_path, metadata_path = recording_cache_paths(file_path)
+    source_signature = recording_signature(file_path)
+
+    # Reuse the cache while it matches the source file
+    if use_cache and recording_cache_is_current(file_path):
+        recording = np.load(cache_path, mmap_mode=mmap_mode)
+        return recording[0], recording[1]
+
+    timestamps, values = parse_recording(file_path)
+
+    if use_cache:
+
+        # Write the arrays first and the metadata last, each through an atomic rename of
+        # a temporary file private to this process, so concurrent batch workers never mix writes
+        try:
+            os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+            temporary_cache_path = f"{cache_path}.{os.getpid()}.tmp"
+            temporary_metadata_path = f"{metadata_path}.{os.getpid()}.tmp"
+
+            with open(temporary_cache_path, "wb") as cache_file:
+                np.save(cache_file, np.vstack((timestamps, values)))
+            os.replace(temporary_cache_path, cache_path)
+
+            with open(temporary_metadata_path, "w") as metadata_file:
+                json.dump(source_signature, metadata_file)
+            os.replace(temporary_metadata_path, metadata_path)
 
-    # Convert the values of the dictionary to a NumPy array and return
-    return np.array(list(data.values()))
+        except OSError:
+            pass
 
-def calculate_auto_mutual_information(time_series_data, maximum_delay, number_of_partitions):
+        if mmap_mode is not None and os.path.exists(metadata_path):
+            recording = np.load(cache_path, mmap_mode=mmap_mode)
+            return recording[0], recording[1]
+
+    return timestamps, values
+
+@instrumented
+def calculate_auto_mutual_information(time_series_data, maximum_delay, number_of_partitions, method="histogram", batched=False):
     """
     Calculates the auto mutual information for a given time series. The time series
     data is first normalized, and then mutual information is calculated.
@@ -42,6 +174,8 @@ def calculate_auto_mutual_information(time_series_data, maximum_delay, number_of
     :param time_series_data: The input time series data.
     :param maximum_delay: The maximum delay to consider for mutual information calculation.
     :param number_of_partitions: The number of partitions to use in the mutual information calculation.
+    :param method: 'histogram' for the binned engine or 'partition' for the per-partition scan.
+    :param batched: If True, the histogram engine computes every Tau in a single pass.
     :return: A tuple containing the array of mutual information values and the optimal delay value.
     """
     # Normalizing the time series data
@@ -51,7 +185,7 @@ def calculate_auto_mutual_information(time_series_data, maximum_delay, number_of
     length_of_series = len(normalized_time_series)
 
     # Calculate mutual information and the optimal delay
-    mutual_information_values, optimal_delay_value = calculate_pim(normalized_time_series, maximum_delay, number_of_partitions, length_of_series)
+    mutual_information_values, optimal_delay_value = calculate_pim(normalized_time_series, maximum_delay, number_of_partitions, length_of_series, method, batched)
 
     return mutual_information_values, optimal_delay_value
 
@@ -103,6 +237,104 @@ def calculate_mutual_information(time_series_data, tau_values, number_of_partiti
 
     return mutual_information_values
 
+def digitize_time_series(time_series_data, number_of_partitions):
+    """
+    Assigns every sample of a normalized time series to its partition. Partition p
+    holds the values in ((p - 1) / P, p / P], the same intervals used by
+    calculate_mutual_information. Samples outside every partition (the minimum of
+    the normalized series) are assigned to the extra index P.
+
+    :param time_series_data: The normalized time series data, with values in [0, 1].
+    :param number_of_partitions: The number of partitions P.
+    :return: Integer array of partition indices in the range [0, P].
+    """
+    # Partition edges computed exactly as in calculate_mutual_information
+    partition_edges = np.arange(number_of_partitions + 1) / number_of_partitions
+
+    # Index i satisfies edges[i - 1] < value <= edges[i], so partition i - 1 (0-based)
+    partition_indices = np.searchsorted(partition_edges, time_series_data, side="left") - 1
+
+    # Values not covered by any partition go to the extra bin
+    partition_indices[(partition_indices < 0) | (partition_indices >= number_of_partitions)] = number_of_partitions
+
+    return partition_indices
+
+def mutual_information_from_joint_counts(joint_counts, number_of_partitions, number_of_pairs):
+    """
+    Calculates mutual information from joint partition counts. The counts include
+    the extra bin produced by digitize_time_series, which contributes to neither
+    marginal nor joint probabilities but still counts towards the number of pairs.
+
+    :param joint_counts: Array of shape (..., P + 1, P + 1) with joint partition counts.
+    :param number_of_partitions: The number of partitions P.
+    :param number_of_pairs: Number of (x, y) pairs behind each joint histogram.
+    :return: Array of mutual information values, one per leading index.
+    """
+    joint_counts = np.asarray(joint_counts, dtype=np.float64)
+    number_of_pairs = np.asarray(number_of_pairs, dtype=np.float64)[..., np.newaxis, np.newaxis]
+
+    # Marginal probabilities from the row and column sums of the joint histogram
+    probability_px = joint_counts.sum(axis=-1)[..., :number_of_partitions, np.newaxis] / number_of_pairs
+    probability_py = joint_counts.sum(axis=-2)[..., np.newaxis, :number_of_partitions] / number_of_pairs
+    probability_pxy = joint_counts[..., :number_of_partitions, :number_of_partitions] / number_of_pairs
+
+    # Only populated cells contribute to the mutual information
+    populated = probability_pxy > 0
+    probability_independent = np.broadcast_to(probability_px * probability_py, probability_pxy.shape)
+    terms = np.zeros_like(probability_pxy)
+    terms[populated] = probability_pxy[populated] * np.log2(probability_pxy[populated] / probability_independent[populated])
+
+    return terms.sum(axis=(-2, -1))
+
+def calculate_mutual_information_histogram(time_series_data, tau_values, number_of_partitions, time_series_length, batched=False):
+    """
+    Calculates mutual information for a time series for a given set of Tau values
+    using partition histograms. The series is binned once, and each joint distribution
+    is built with a single bincount, so the cost is O(len(tau_values) * N) instead of
+    O(len(tau_values) * P^2 * N). Returns the same values as calculate_mutual_information.
+
+    :param time_series_data: The normalized time series data.
+    :param tau_values: A range of Tau values to consider in the calculation.
+    :param number_of_partitions: The number of partitions for histogram calculation.
+    :param time_series_length: The length of the time series data.
+    :param batched: If True, the joint histograms of all Tau values are built in one bincount.
+    :return: An array of mutual information values corresponding to each Tau value.
+    """
+    tau_values = np.asarray(list(tau_values), dtype=np.int64)
+    bins_per_axis = number_of_partitions + 1
+    bins_per_histogram = bins_per_axis * bins_per_axis
+
+    # Bin the series once for every Tau value
+    partition_indices = digitize_time_series(np.asarray(time_series_data[:time_series_length]), number_of_partitions)
+    number_of_pairs = time_series_length - tau_values
+
+    if batched:
+
+        # Pair every sample with its delayed sample for every Tau at once; pairs that run
+        # past the end of the series are routed to a discarded histogram
+        sample_positions = np.arange(time_series_length)
+        delayed_positions = sample_positions[np.newaxis, :] + tau_values[:, np.newaxis]
+        valid_pairs = delayed_positions < time_series_length
+        delayed_indices = partition_indices[np.minimum(delayed_positions, time_series_length - 1)]
+
+        pair_codes = np.arange(len(tau_values))[:, np.newaxis] * bins_per_histogram + partition_indices[np.newaxis, :] * bins_per_axis + delayed_indices
+        pair_codes[~valid_pairs] = len(tau_values) * bins_per_histogram
+
+        joint_counts = np.bincount(pair_codes.ravel(), minlength=(len(tau_values) + 1) * bins_per_histogram)
+        joint_counts = joint_counts[:len(tau_values) * bins_per_histogram].reshape(len(tau_values), bins_per_axis, bins_per_axis)
+
+    else:
+
+        joint_counts = np.empty((len(tau_values), bins_per_axis, bins_per_axis), dtype=np.int64)
+
+        for tau_index, tau in enumerate(tau_values):
+
+            # Joint histogram of (x[t], x[t + tau]) from a single bincount
+            pair_codes = partition_indices[:time_series_length - tau] * bins_per_axis + partition_indices[tau:time_series_length]
+            joint_counts[tau_index] = np.bincount(pair_codes, minlength=bins_per_histogram).reshape(bins_per_axis, bins_per_axis)
+
+    return list(mutual_information_from_joint_counts(joint_counts, number_of_partitions, number_of_pairs))
+
 def find_prime_index(pim_values, time_series_length):
     """
     Finds the prime index in an array of Phase Information Measure (PIM) values.
@@ -125,7 +357,7 @@ def find_prime_index(pim_values, time_series_length):
         
     return 0
 
-def calculate_pim(time_series_data, maximum_tau, number_of_partitions, time_series_length):
+def calculate_pim(time_series_data, maximum_tau, number_of_partitions, time_series_length, method="histogram", batched=False):
     """
     Calculates the Phase Information Measure (PIM) for a time series. It computes the mutual
     information for a range of Tau values and identifies the optimal Tau value.
@@ -134,10 +366,17 @@ def calculate_pim(time_series_data, maximum_tau, number_of_partitions, time_seri
     :param maximum_tau: The maximum Tau value to consider in the calculation.
     :param number_of_partitions: The number of partitions to use in the mutual information calculation.
     :param time_series_length: The length of the time series data.
+    :param method: 'histogram' for the binned engine or 'partition' for the per-partition scan.
+    :param batched: If True, the histogram engine computes every Tau in a single pass.
     :return: A tuple containing the PIM values array and the optimal Tau value.
     """
     # Calculate mutual information for a range of Tau values
-    pim_values = calculate_mutual_information(time_series_data, range(1, maximum_tau + 1), number_of_partitions, time_series_length)
+    if method == "histogram":
+        pim_values = calculate_mutual_information_histogram(time_series_data, range(1, maximum_tau + 1), number_of_partitions, time_series_length, batched)
+    elif method == "partition":
+        pim_values = calculate_mutual_information(time_series_data, range(1, maximum_tau + 1), number_of_partitions, time_series_length)
+    else:
+        raise ValueError(f"Unknown mutual information method: {method}")
     
     # Determine the optimal Tau value
     optimal_tau_value = find_prime_index(pim_values, time_series_length)
@@ -145,17 +384,24 @@ def calculate_pim(time_series_data, maximum_tau, number_of_partitions, time_seri
     
     return pim_values, optimal_tau_value
 
-def phase_space_reconstruction(time_series_data, embedding_dimension, delay, number_of_points=None):
+@instrumented
+def phase_space_reconstruction(time_series_data, embedding_dimension, delay, number_of_points=None, copy=True, dtype=None):
     """
     Performs phase space reconstruction on a given time series. The reconstruction 
     involves creating a matrix where each column is a delayed version of the time 
     series, based on the specified embedding dimension and delay.
 
+    With copy=False the reconstruction is a read-only strided view of the series, so
+    no matrix is allocated and memory use does not grow with the embedding dimension.
+
     :param time_series_data: The time series data to be reconstructed.
     :param embedding_dimension: The embedding dimension for the reconstruction.
     :param delay: The delay to be used in the reconstruction.
     :param number_of_points: Optional; number of points to consider in the reconstruction.
                              If None, calculates automatically based on series length.
+    :param copy: If False, returns a read-only sliding-window view instead of a new array.
+    :param dtype: Optional; data type of the reconstruction, e.g. np.float32. Converting
+                  the series to another type copies the series once, not the embedding.
     :return: The reconstructed phase space as a 2D numpy array.
     """
     time_series_length = len(time_series_data)
@@ -164,8 +410,17 @@ def phase_space_reconstruction(time_series_data, embedding_dimension, delay, num
     if number_of_points is None:
         number_of_points = time_series_length - (embedding_dimension - 1) * delay
 
+    if not copy:
+
+        # Each row of the window view spans one delay vector; keep every delay-th column
+        time_series_data = np.asarray(time_series_data, dtype=dtype)
+        window_length = (embedding_dimension - 1) * delay + 1
+        reconstructed_space = sliding_window_view(time_series_data, window_length)[:number_of_points, ::delay]
+
+        return reconstructed_space
+
     # Initialize the reconstructed space array
-    reconstructed_space = np.zeros((number_of_points, embedding_dimension))
+    reconstructed_space = np.zeros((number_of_points, embedding_dimension), dtype=dtype if dtype is not None else np.float64)
 
     # Construct the reconstructed space
     for dimension in range(embedding_dimension):
@@ -173,7 +428,116 @@ def phase_space_reconstruction(time_series_data, embedding_dimension, delay, num
 
     return reconstructed_space
 
-def knn_dimension_estimation(time_series_data, delay, max_embedding_dimension, relative_tolerance, absolute_tolerance):
+@instrumented
+def nearest_neighbor_query(reconstructed_data):
+    """
+    Finds the nearest neighbor of every point of a reconstructed phase space with a
+    single batched query. Column 0 of the result is the point itself and column 1
+    its nearest neighbor, as returned by sklearn's NearestNeighbors.
+
+    :param reconstructed_data: Reconstructed phase space data.
+    :return: Tuple containing the distances and indices arrays, both of shape (points, 2).
+    """
+    from sklearn.neighbors import NearestNeighbors
+
+    # Use NearestNeighbors for efficient neighbor search
+    nearest_neighbors_model = NearestNeighbors(n_neighbors=2, algorithm='auto').fit(reconstructed_data)
+    distances, indices = nearest_neighbors_model.kneighbors(reconstructed_data)
+
+    return distances, indices
+
+def false_neighbor_flags(time_series_data, point_indices, neighbor_indices, neighbor_distances, embedding_dimension, delay, relative_tolerance, absolute_tolerance, standard_deviation_of_data):
+    """
+    Applies the distance-ratio and absolute-tolerance tests of the false nearest
+    neighbors method to a set of reconstructed points and their nearest neighbors.
+
+    :param time_series_data: The time series data that was reconstructed.
+    :param point_indices: Indices of the reconstructed points.
+    :param neighbor_indices: Index of the nearest neighbor of each point.
+    :param neighbor_distances: Distance to the nearest neighbor of each point.
+    :param embedding_dimension: The embedding dimension of the reconstruction.
+    :param delay: The delay used in the phase space reconstruction.
+    :param relative_tolerance: The relative tolerance for nearest neighbor search.
+    :param absolute_tolerance: The absolute tolerance for nearest neighbor search.
+    :param standard_deviation_of_data: Standard deviation of the series.
+    :return: Boolean array, True where the neighbor is false. Points whose next delayed
+             coordinate lies past the reconstruction, and neighbors whose next delayed
+             coordinate lies past the series, are never false.
+    """
+    total_data_points = len(time_series_data)
+    reconstructed_data_length = total_data_points - (embedding_dimension - 1) * delay
+    next_coordinate_offset = embedding_dimension * delay
+
+    # Points whose next delayed coordinate lies inside the reconstruction
+    valid_points = point_indices + next_coordinate_offset < reconstructed_data_length
+    point_positions = np.minimum(point_indices + next_coordinate_offset, total_data_points - 1)
+
+    # Skip neighbors whose next delayed coordinate falls past the end of the series
+    valid_neighbors = neighbor_indices + next_coordinate_offset < total_data_points
+    neighbor_positions = np.minimum(neighbor_indices + next_coordinate_offset, total_data_points - 1)
+
+    # Distance-ratio and absolute-tolerance tests for every point at once
+    with np.errstate(divide='ignore', invalid='ignore'):
+        distance_ratio = np.abs(time_series_data[point_positions] - time_series_data[neighbor_positions]) / neighbor_distances
+        combined_distance = np.sqrt(distance_ratio ** 2 + neighbor_distances ** 2)
+        false_neighbors = valid_points & valid_neighbors & ((distance_ratio > relative_tolerance) | (combined_distance / standard_deviation_of_data > absolute_tolerance))
+
+    return false_neighbors
+
+def calculate_false_nearest_neighbors(time_series_data, distances, indices, embedding_dimension, delay, relative_tolerance, absolute_tolerance, standard_deviation_of_data=None):
+    """
+    Calculates the fraction of false nearest neighbors for one embedding dimension from
+    the result of nearest_neighbor_query. The tests of false_neighbor_flags are applied
+    to every point at once.
+
+    :param time_series_data: The time series data that was reconstructed.
+    :param distances: Neighbor distances of the reconstructed points.
+    :param indices: Neighbor indices of the reconstructed points.
+    :param embedding_dimension: The embedding dimension of the reconstruction.
+    :param delay: The delay used in the phase space reconstruction.
+    :param relative_tolerance: The relative tolerance for nearest neighbor search.
+    :param absolute_tolerance: The absolute tolerance for nearest neighbor search.
+    :param standard_deviation_of_data: Optional; standard deviation of the series, computed if None.
+    :return: Fraction of false nearest neighbors.
+    """
+    time_series_data = np.asarray(time_series_data)
+    reconstructed_data_length = len(indices)
+
+    if standard_deviation_of_data is None:
+        standard_deviation_of_data = np.std(time_series_data)
+
+    # Only points whose next delayed coordinate lies inside the series can be false
+    number_of_reference_points = max(reconstructed_data_length - embedding_dimension * delay, 0)
+    false_neighbors = false_neighbor_flags(time_series_data, np.arange(number_of_reference_points), indices[:number_of_reference_points, 1],
+                                           distances[:number_of_reference_points, 1], embedding_dimension, delay, relative_tolerance,
+                                           absolute_tolerance, standard_deviation_of_data)
+
+    return np.count_nonzero(false_neighbors) / reconstructed_data_length
+
+@instrumented
+def false_nearest_neighbors_for_dimension(time_series_data, delay, embedding_dimension, relative_tolerance, absolute_tolerance, standard_deviation_of_data=None):
+    """
+    Reconstructs the phase space for one embedding dimension and returns its fraction
+    of false nearest neighbors.
+
+    :param time_series_data: The time series data for dimension estimation.
+    :param delay: The delay to use in the phase space reconstruction.
+    :param embedding_dimension: The embedding dimension to evaluate.
+    :param relative_tolerance: The relative tolerance for nearest neighbor search.
+    :param absolute_tolerance: The absolute tolerance for nearest neighbor search.
+    :param standard_deviation_of_data: Optional; standard deviation of the series, computed if None.
+    :return: Fraction of false nearest neighbors.
+    """
+    reconstructed_data = phase_space_reconstruction(time_series_data, embedding_dimension, delay, copy=False)
+    distances, indices = nearest_neighbor_query(reconstructed_data)
+
+    return calculate_false_nearest_neighbors(time_series_data, distances, indices, embedding_dimension, delay, relative_tolerance, absolute_tolerance, standard_deviation_of_data)
+
+# Fraction of false nearest neighbors below which an embedding dimension is accepted
+FALSE_NEIGHBORS_THRESHOLD = 0.15
+
+@instrumented
+def knn_dimension_estimation(time_series_data, delay, max_embedding_dimension, relative_tolerance, absolute_tolerance, n_jobs=1):
     """
     Estimates the embedding dimension for a time series using the K-nearest neighbors method.
     The function calculates the fraction of false nearest neighbors (FNN) for dimensions up to the maximum specified,
@@ -184,38 +548,51 @@ def knn_dimension_estimation(time_series_data, delay, max_embedding_dimension, r
     :param max_embedding_dimension: The maximum embedding dimension to consider.
     :param relative_tolerance: The relative tolerance for nearest neighbor search.
     :param absolute_tolerance: The absolute tolerance for nearest neighbor search.
+    :param n_jobs: Number of dimensions evaluated in parallel; -1 uses every CPU.
+                   Dimensions past the first one below the FNN threshold are discarded.
     :return: Tuple containing the FNN array, the estimated embedding dimension, and a list of dimensions considered.
     """
-    total_data_points = len(time_series_data)
+    time_series_data = np.asarray(time_series_data)
     standard_deviation_of_data = np.std(time_series_data)
     fnn_values = np.zeros(max_embedding_dimension)
     estimated_embedding_dimension = 0
 
-    for current_dimension in range(1, max_embedding_dimension + 1):
-        reconstructed_data = phase_space_reconstruction(time_series_data, current_dimension, delay)
-        reconstructed_data_length = len(reconstructed_data)
+    if n_jobs is None or n_jobs < 1:
+        n_jobs = os.cpu_count() or 1
 
-        # Use NearestNeighbors for efficient neighbor search
-        nearest_neighbors_model = NearestNeighbors(n_neighbors=2, algorithm='auto').fit(reconstructed_data)
-        distances, indices = nearest_neighbors_model.kneighbors(reconstructed_data)
+    # Pool threads record their stages under the stage that called this function
+    parent_stages = instrumentation.current_stages()
 
-        for i in range(reconstructed_data_length - current_dimension * delay):
-            nearest_neighbor_index = indices[i, 1]
+    def evaluate_dimension(current_dimension):
 
-            if i + current_dimension * delay < total_data_points and nearest_neighbor_index + current_dimension * delay < total_data_points:
+        with instrumentation.adopt_stages(parent_stages):
+            return false_nearest_neighbors_for_dimension(time_series_data, delay, current_dimension, relative_tolerance, absolute_tolerance, standard_deviation_of_data)
 
-                distance_ratio = abs(time_series_data[i + current_dimension * delay] - time_series_data[nearest_neighbor_index + current_dimension * delay]) / distances[i, 1]
-                combined_distance = np.sqrt(distance_ratio ** 2 + distances[i, 1] ** 2)
+    # A single job runs on the calling thread; a pool is only worth it for several
+    executor = ThreadPoolExecutor(max_workers=n_jobs) if n_jobs > 1 else None
+    map_dimensions = executor.map if executor is not None else map
 
-                if distance_ratio > relative_tolerance or combined_distance / standard_deviation_of_data > absolute_tolerance:
-                    fnn_values[current_dimension - 1] += 1
+    try:
 
-        fnn_values[current_dimension - 1] /= reconstructed_data_length
+        # Evaluate the dimensions in groups of n_jobs so the early stop still saves work
+        for first_dimension in range(1, max_embedding_dimension + 1, n_jobs):
+            batch_dimensions = range(first_dimension, min(first_dimension + n_jobs, max_embedding_dimension + 1))
 
-        if fnn_values[current_dimension - 1] < 0.15:
+            for current_dimension, fnn_fraction in zip(batch_dimensions, map_dimensions(evaluate_dimension, batch_dimensions)):
+                fnn_values[current_dimension - 1] = fnn_fraction
 
-            estimated_embedding_dimension = current_dimension
-            break
+                if fnn_fraction < FALSE_NEIGHBORS_THRESHOLD:
+
+                    estimated_embedding_dimension = current_dimension
+                    break
+
+            if estimated_embedding_dimension != 0:
+                break
+
+    finally:
+
+        if executor is not None:
+            executor.shutdown()
 
     if estimated_embedding_dimension == 0:
         estimated_embedding_dimension = np.argmin(fnn_values) + 1
@@ -224,7 +601,366 @@ def knn_dimension_estimation(time_series_data, delay, max_embedding_dimension, r
 
     return fnn_values, estimated_embedding_dimension, dimensions_considered
 
-def plot_attractor(reconstructed_data, file_name, save_directory, plot_title="Phase Space Attractor"):
+def logarithmic_radii(minimum_radius, maximum_radius, factor):
+    """
+    Creates radii by successively multiplying a minimum radius by a factor until the
+    maximum radius is reached, as nolds.logarithmic_r does.
+
+    :param minimum_radius: The smallest radius.
+    :param maximum_radius: The largest radius.
+    :param factor: The growth factor between consecutive radii, greater than 1.
+    :return: Array of radii.
+    """
+    number_of_radii = int(np.floor(np.log(maximum_radius / minimum_radius) / np.log(factor))) + 1
+
+    return minimum_radius * factor ** np.arange(number_of_radii)
+
+# Seed of the RANSAC fits of analyze_recording and its sweeps, so repeated runs agree
+RANSAC_RANDOM_STATE = 0
+
+def fit_line(x_values, y_values, fit="RANSAC", random_state=None):
+    """
+    Fits a line through the given points with the same fitting modes as nolds.
+
+    :param x_values: The x coordinates.
+    :param y_values: The y coordinates.
+    :param fit: 'RANSAC' for a robust fit or 'poly' for least squares.
+    :param random_state: Optional; seed of the RANSAC samples. None draws them from the
+                         global numpy generator, as nolds does, so repeated fits differ.
+    :return: The polynomial coefficients, slope first.
+    """
+    import nolds
+
+    if fit != "RANSAC" or random_state is None:
+        return nolds.measures.poly_fit(x_values, y_values, 1, fit=fit)
+
+    import warnings
+    from sklearn.linear_model import LinearRegression, RANSACRegressor
+
+    # The RANSAC fit of nolds.measures.poly_fit with a fixed seed
+    x_values = np.asarray(x_values, dtype=np.float64)
+    model = RANSACRegressor(LinearRegression(fit_intercept=False), random_state=random_state)
+
+    try:
+        model.fit(np.column_stack((np.ones(len(x_values)), x_values)), y_values)
+        return model.estimator_.coef_[::-1]
+    except ValueError:
+        warnings.warn("RANSAC did not reach consensus, using numpy's polyfit", RuntimeWarning)
+        return np.polyfit(x_values, y_values, 1)
+
+# Number of reference points above which the correlation sums are estimated from a subsample
+CORRELATION_REFERENCE_POINTS = 5000
+
+@instrumented
+def calculate_correlation_sums(reconstructed_data, radius_values, max_reference_points=CORRELATION_REFERENCE_POINTS, seed=0):
+    """
+    Calculates the correlation sums of a reconstructed phase space with a KD-tree. All
+    radii are counted in one dual-tree pass using the Euclidean distance.
+    Self-matches are counted, like the distance matrix used by nolds.corr_dim. Up to
+    max_reference_points points every pair is counted and the sums equal nolds; above
+    it the pairs between a fixed random subsample of reference points and all points
+    are counted and rescaled, so the work grows linearly with the number of points.
+
+    :param reconstructed_data: Reconstructed phase space data.
+    :param radius_values: Array of radii.
+    :param max_reference_points: Optional; largest number of reference points, or None
+                                 to always count every pair.
+    :param seed: Optional; seed of the reference point subsample, fixed so repeated
+                 calls give the same sums.
+    :return: Array of correlation sums, one per radius.
+    """
+    from sklearn.neighbors import KDTree
+
+    reconstructed_data = np.ascontiguousarray(reconstructed_data, dtype=np.float64)
+    number_of_points = len(reconstructed_data)
+
+    # A one-dimensional strided view is already contiguous but read-only, which the tree queries reject
+    if not reconstructed_data.flags.writeable:
+        reconstructed_data = reconstructed_data.copy()
+
+    reference_points = reconstructed_data
+
+    # A fixed-size subsample bounds the pairs counted on long recordings
+    if max_reference_points is not None and number_of_points > max_reference_points:
+        reference_indices = np.random.default_rng(seed).choice(number_of_points, max_reference_points, replace=False)
+        reference_points = reconstructed_data[np.sort(reference_indices)]
+
+    # Count the pairs of the reference points within each radius in one dual-tree traversal
+    tree = KDTree(reconstructed_data)
+    pair_counts = tree.two_point_correlation(reference_points, radius_values, dualtree=True)
+
+    return pair_counts / (len(reference_points) * (number_of_points - 1))
+
+@instrumented
+def correlation_dimension(time_series_data, embedding_dimension, delay=1, radius_values=None, fit="RANSAC", max_reference_points=CORRELATION_REFERENCE_POINTS, random_state=None):
+    """
+    Estimates the correlation dimension of a time series with the Grassberger-Procaccia
+    algorithm. The phase space comes from phase_space_reconstruction and the correlation
+    sums from radius counts on a KD-tree, so no pairwise distance matrix is built.
+    Matches nolds.corr_dim for the same embedding, lag and radii up to
+    max_reference_points reconstructed points; longer series use a reference point
+    subsample (see calculate_correlation_sums).
+
+    :param time_series_data: The time series data.
+    :param embedding_dimension: The embedding dimension for the reconstruction.
+    :param delay: The delay to be used in the reconstruction.
+    :param radius_values: Optional; radii for the correlation sums. Defaults to the
+                          nolds radii between 0.1 and 0.5 standard deviations.
+    :param fit: 'RANSAC' for a robust fit or 'poly' for least squares.
+    :param max_reference_points: Optional; largest number of reference points for the
+                                 correlation sums, or None to count every pair.
+    :param random_state: Optional; seed of the RANSAC fit (see fit_line).
+    :return: The correlation dimension.
+    """
+    time_series_data = np.asarray(time_series_data, dtype=np.float64)
+
+    if radius_values is None:
+        standard_deviation_of_data = np.std(time_series_data, ddof=1)
+        radius_values = logarithmic_radii(0.1 * standard_deviation_of_data, 0.5 * standard_deviation_of_data, 1.03)
+
+    radius_values = np.asarray(radius_values, dtype=np.float64)
+    reconstructed_data = phase_space_reconstruction(time_series_data, embedding_dimension, delay, copy=False)
+    correlation_sums = calculate_correlation_sums(reconstructed_data, radius_values, max_reference_points)
+
+    # Zero sums cannot be placed on the log-log plot
+    nonzero = correlation_sums > 0
+
+    if not np.any(nonzero):
+        return np.nan
+
+    return fit_line(np.log(radius_values[nonzero]), np.log(correlation_sums[nonzero]), fit, random_state)[0]
+
+def mean_period(time_series_data):
+    """
+    Calculates the mean period of a time series as the inverse of its power-weighted
+    mean frequency, the default Theiler window of nolds.lyap_r.
+
+    :param time_series_data: The time series data.
+    :return: Mean period in samples, at most a quarter of the series length.
+    """
+    time_series_length = len(time_series_data)
+
+    # Power spectrum of the zero-padded series
+    spectrum = np.fft.rfft(time_series_data, time_series_length * 2 - 1)
+    frequencies = np.fft.rfftfreq(time_series_length * 2 - 1)
+    power = np.abs(spectrum) ** 2
+    mean_frequency = np.sum(frequencies[1:] * power[1:]) / np.sum(power[1:])
+
+    return min(int(np.ceil(1.0 / mean_frequency)), int(0.25 * time_series_length))
+
+@instrumented
+def nearest_neighbors_outside_window(reconstructed_data, theiler_window):
+    """
+    Finds the nearest neighbor of every point of a reconstructed phase space among the
+    points more than theiler_window samples away in time. A first KD-tree query of a
+    few neighbors resolves most points. For the rest, the points just outside the window
+    bound the neighbor distance, and a radius query within that bound finds the neighbor.
+    Among equally distant neighbors the earliest point is chosen, as in nolds.lyap_r.
+
+    :param reconstructed_data: Reconstructed phase space data.
+    :param theiler_window: Minimum temporal separation of a neighbor.
+    :return: Array with the index of the nearest neighbor of every point.
+    """
+    from sklearn.neighbors import KDTree
+
+    reconstructed_data = np.ascontiguousarray(reconstructed_data, dtype=np.float64)
+    number_of_points = len(reconstructed_data)
+    point_indices = np.arange(number_of_points)
+
+    # A one-dimensional strided view is already contiguous but read-only, which the tree queries reject
+    if not reconstructed_data.flags.writeable:
+        reconstructed_data = reconstructed_data.copy()
+    tree = KDTree(reconstructed_data)
+
+    # Nearest candidate outside the window; the tree orders equal distances arbitrarily,
+    # so among ties the earliest index is taken explicitly
+    distances, candidates = tree.query(reconstructed_data, k=min(16, number_of_points))
+    outside_window = np.abs(candidates - point_indices[:, np.newaxis]) > theiler_window
+    neighbor_distances = np.min(np.where(outside_window, distances, np.inf), axis=1)
+    nearest_outside = outside_window & (distances == neighbor_distances[:, np.newaxis])
+    neighbor_indices = np.min(np.where(nearest_outside, candidates, number_of_points), axis=1)
+
+    # Points whose candidates all lie in the window, or whose neighbor distance ties the
+    # last candidate, are resolved with a radius query
+    pending_points = point_indices[~np.any(outside_window, axis=1) | (neighbor_distances == distances[:, -1])]
+
+    if len(pending_points) > 0:
+
+        # The closer of the two points just outside the window bounds the neighbor distance
+        before_window = np.maximum(pending_points - theiler_window - 1, 0)
+        after_window = np.minimum(pending_points + theiler_window + 1, number_of_points - 1)
+        distance_before = np.where(pending_points - theiler_window - 1 >= 0, np.linalg.norm(reconstructed_data[pending_points] - reconstructed_data[before_window], axis=1), np.inf)
+        distance_after = np.where(pending_points + theiler_window + 1 < number_of_points, np.linalg.norm(reconstructed_data[pending_points] - reconstructed_data[after_window], axis=1), np.inf)
+        search_radii = np.minimum(distance_before, distance_after)
+
+        # Pad the bound so rounding never drops the bounding point itself
+        candidate_lists, candidate_distances = tree.query_radius(reconstructed_data[pending_points], search_radii * (1 + 1e-9) + 1e-12, return_distance=True)
+
+        for point, candidate_list, candidate_distance in zip(pending_points, candidate_lists, candidate_distances):
+            outside = np.abs(candidate_list - point) > theiler_window
+            candidate_list = candidate_list[outside]
+            candidate_distance = candidate_distance[outside]
+
+            # Nearest candidate, earliest index first among ties
+            nearest = candidate_distance == candidate_distance.min()
+            neighbor_indices[point] = candidate_list[nearest].min()
+
+    return neighbor_indices
+
+@instrumented
+def largest_lyapunov_exponent(time_series_data, embedding_dimension, delay=1, theiler_window=None, trajectory_length=20, fit="RANSAC", fit_offset=0, sampling_interval=1,
+                              random_state=None):
+    """
+    Estimates the largest Lyapunov exponent of a time series with the Rosenstein
+    algorithm. The phase space comes from phase_space_reconstruction and the nearest
+    neighbors from KD-tree queries restricted by a Theiler window, so no pairwise
+    distance matrix is built. Matches nolds.lyap_r for the same embedding, lag and
+    min_tsep.
+
+    :param time_series_data: The time series data.
+    :param embedding_dimension: The embedding dimension for the reconstruction.
+    :param delay: The delay to be used in the reconstruction.
+    :param theiler_window: Optional; minimum temporal separation of neighbors. Defaults
+                           to the mean period of the series.
+    :param trajectory_length: Number of steps each neighbor pair is followed.
+    :param fit: 'RANSAC' for a robust fit or 'poly' for least squares.
+    :param fit_offset: Number of initial divergence steps left out of the fit.
+    :param sampling_interval: Time between samples, used to scale the exponent.
+    :param random_state: Optional; seed of the RANSAC fit (see fit_line).
+    :return: The largest Lyapunov exponent.
+    """
+    time_series_data = np.asarray(time_series_data, dtype=np.float64)
+
+    if theiler_window is None:
+        theiler_window = mean_period(time_series_data)
+
+    reconstructed_data = phase_space_reconstruction(time_series_data, embedding_dimension, delay, copy=False)
+
+    # Only points that can be followed for the whole trajectory are paired
+    number_of_trajectories = len(reconstructed_data) - trajectory_length + 1
+
+    if number_of_trajectories < theiler_window * 2 + 2:
+        raise ValueError(f"Not enough data points: {theiler_window * 2 + 2} trajectories are required for a Theiler window of {theiler_window}, but only {number_of_trajectories} could be created.")
+
+    neighbor_indices = nearest_neighbors_outside_window(reconstructed_data[:number_of_trajectories], theiler_window)
+    point_indices = np.arange(number_of_trajectories)
+
+    # Mean logarithmic distance of the neighbor pairs after each step
+    divergence = np.zeros(trajectory_length)
+
+    for step in range(trajectory_length):
+        step_distances = np.linalg.norm(reconstructed_data[point_indices + step] - reconstructed_data[neighbor_indices + step], axis=1)
+        step_distances = step_distances[step_distances != 0]
+        divergence[step] = np.mean(np.log(step_distances)) if len(step_distances) > 0 else -np.inf
+
+    # Leave steps without any nonzero distance out of the fit
+    steps = np.arange(trajectory_length)
+    finite = np.isfinite(divergence)
+
+    if not np.any(finite):
+        return -np.inf
+
+    return fit_line(steps[finite][fit_offset:], divergence[finite][fit_offset:], fit, random_state)[0] / sampling_interval
+
+@instrumented
+def hurst_exponent(time_series_data, random_state=None):
+    """
+    Estimates the Hurst exponent of a time series with the rescaled range method.
+
+    :param time_series_data: The time series data.
+    :param random_state: Optional; seed of the RANSAC fit (see fit_line).
+    :return: The Hurst exponent (nolds.hurst_rs).
+    """
+    import nolds
+
+    if random_state is None:
+        return nolds.hurst_rs(time_series_data)
+
+    # The rescaled ranges of nolds.hurst_rs, corrected and fitted with a seeded RANSAC
+    _, (log_window_sizes, log_rescaled_ranges, _) = nolds.hurst_rs(time_series_data, fit="poly", debug_data=True)
+
+    if len(log_window_sizes) == 0:
+        return np.nan
+
+    window_sizes = np.rint(np.exp(log_window_sizes)).astype(int)
+    corrected_log_rescaled_ranges = log_rescaled_ranges - np.log([nolds.measures.expected_rs(window_size) for window_size in window_sizes])
+
+    return fit_line(log_window_sizes, corrected_log_rescaled_ranges, "RANSAC", random_state)[0] + 0.5
+
+# When True, figures are closed after saving and plt.show() is never called
+HEADLESS_PLOTTING = False
+
+def configure_plotting(headless=True):
+    """
+    Selects how plots are rendered. In headless mode the Agg backend is used, every
+    figure is closed as soon as it is saved and nothing blocks on a window, so plots
+    can be generated in batch runs and worker processes without leaking memory.
+
+    :param headless: If True, switches to headless rendering; if False, figures stay
+                     open and plot_attractor shows them.
+    """
+    global HEADLESS_PLOTTING
+
+    if headless:
+        import matplotlib.pyplot as plt
+        plt.switch_backend("Agg")
+
+    HEADLESS_PLOTTING = headless
+
+def release_figure(figure):
+    """
+    Closes a saved figure in headless mode. Interactive figures stay open until shown.
+
+    :param figure: The matplotlib figure.
+    """
+    if HEADLESS_PLOTTING:
+        import matplotlib.pyplot as plt
+        plt.close(figure)
+
+def decimate_min_max(data, number_of_buckets):
+    """
+    Reduces a time series to the minimum and maximum of each of number_of_buckets equal
+    buckets, in time order. Drawn as a line, the result has the same envelope as the
+    full series at a width of number_of_buckets pixels.
+
+    :param data: The time series data.
+    :param number_of_buckets: Number of buckets, typically the plot width in pixels.
+    :return: Tuple containing the sample positions and values to draw.
+    """
+    data = np.asarray(data)
+    positions = np.arange(len(data))
+
+    if len(data) <= 2 * number_of_buckets:
+        return positions, data
+
+    # Trim to whole buckets and find the extremes of each bucket
+    bucket_size = len(data) // number_of_buckets
+    buckets = data[:bucket_size * number_of_buckets].reshape(number_of_buckets, bucket_size)
+    bucket_starts = np.arange(number_of_buckets) * bucket_size
+    minimum_positions = bucket_starts + np.argmin(buckets, axis=1)
+    maximum_positions = bucket_starts + np.argmax(buckets, axis=1)
+
+    # Keep each pair in time order, plus the samples left after the last bucket
+    selected = np.sort(np.stack((minimum_positions, maximum_positions), axis=1), axis=1).ravel()
+    selected = np.concatenate((selected, positions[bucket_size * number_of_buckets:]))
+
+    return positions[selected], data[selected]
+
+def subsample_points(reconstructed_data, max_points):
+    """
+    Keeps every n-th point of a reconstructed phase space so at most max_points remain.
+
+    :param reconstructed_data: Reconstructed phase space data.
+    :param max_points: Maximum number of points to keep; None keeps them all.
+    :return: The subsampled points, as a view where possible.
+    """
+    if max_points is None or len(reconstructed_data) <= max_points:
+        return reconstructed_data
+
+    return reconstructed_data[::int(np.ceil(len(reconstructed_data) / max_points))]
+
+@instrumented
+def plot_attractor(reconstructed_data, file_name, save_directory, plot_title="Phase Space Attractor", max_points=20000):
     """
     Plots the phase space attractor for the given reconstructed data. Generates both
     2D and 3D plots if the reconstructed data has more than two dimensions.
@@ -233,18 +969,26 @@ def plot_attractor(reconstructed_data, file_name, save_directory, plot_title="Ph
     :param file_name: Name of the file to save the plot.
     :param save_directory: Directory to save the plot.
     :param plot_title: Title of the plot. Default is 'Phase Space Attractor'.
+    :param max_points: Maximum number of points drawn; None draws every point.
     """
+    import matplotlib.pyplot as plt
+    from mpl_toolkits.mplot3d import Axes3D  # registers the '3d' projection
+
     # Create the save directory if it doesn't exist
     os.makedirs(save_directory, exist_ok=True)
 
+    # Subsample the trajectory before drawing
+    reconstructed_data = subsample_points(reconstructed_data, max_points)
+
     # Plotting the 2D attractor
-    plt.figure(figsize=(8, 6))
+    fig = plt.figure(figsize=(8, 6))
     plt.plot(reconstructed_data[:, 0], reconstructed_data[:, 1], 'b.', markersize=1, alpha=0.7)
     plt.xlabel('Dimension 1')
     plt.ylabel('Dimension 2')
     plt.title(plot_title)
     plt.grid(True)
     plt.savefig(os.path.join(save_directory, f"ATTR_{file_name}_2D.png"))
+    release_figure(fig)
 
     # Plotting the 3D attractor if there are more than 2 dimensions
     if reconstructed_data.shape[1] > 2:
@@ -257,9 +1001,12 @@ def plot_attractor(reconstructed_data, file_name, save_directory, plot_title="Ph
         ax.set_zlabel('Dimension 3')
         ax.set_title(plot_title)
         plt.savefig(os.path.join(save_directory, f"ATTR_{file_name}_3D.png"))
+        release_figure(fig)
 
-    plt.show()
+    if not HEADLESS_PLOTTING:
+        plt.show()
 
+@instrumented
 def plot_FNN(fnn_values, optimal_embedding_dimension, dimensions, plot_title, save_directory):
     """
     Plots the FNN percentage as a function of embedding dimension and marks the optimal embedding dimension.
@@ -271,7 +1018,9 @@ def plot_FNN(fnn_values, optimal_embedding_dimension, dimensions, plot_title, sa
     :param plot_title: Title for the plot.
     :param save_directory: Directory to save the plot.
     """
-    plt.figure()
+    import matplotlib.pyplot as plt
+
+    fig = plt.figure()
     plt.plot(dimensions, fnn_values * 100, marker='o')  # Convert to percentage
     plt.axvline(x=optimal_embedding_dimension, color='red', linestyle='--', label=f'Optimal Dimension: {optimal_embedding_dimension}')
     plt.xlabel("Embedding Dimension")
@@ -283,8 +1032,10 @@ def plot_FNN(fnn_values, optimal_embedding_dimension, dimensions, plot_title, sa
     # Create the save directory if it doesn't exist
     os.makedirs(save_directory, exist_ok=True)
     plt.savefig(os.path.join(save_directory, f"FNN_{plot_title}.png"))
+    release_figure(fig)
 
-def plot_data_series(data, plot_title, save_directory):
+@instrumented
+def plot_data_series(data, plot_title, save_directory, decimate=True):
     """
     Plots a data series and saves the plot to a specified directory. The plot is 
     saved with the provided plot title as the file name.
@@ -292,12 +1043,21 @@ def plot_data_series(data, plot_title, save_directory):
     :param data: Data to be plotted, typically a time series.
     :param plot_title: Title for the plot.
     :param save_directory: Directory to save the plot.
+    :param decimate: If True, long series are reduced to their min/max per pixel before drawing.
     """
+    import matplotlib.pyplot as plt
+
     # Create a plot with specific size
     fig, ax = plt.subplots(figsize=(36, 4))
 
+    # Keep the per-pixel extremes of long series
+    if decimate:
+        positions, data = decimate_min_max(data, int(fig.get_figwidth() * fig.dpi))
+    else:
+        positions = np.arange(len(data))
+
     # Plot the data
-    ax.plot(data, "#000000", linewidth=1.25)
+    ax.plot(positions, data, "#000000", linewidth=1.25)
 
     # Set up grid lines
     ax.grid(which='major', color='#94a6d1', linewidth=0.5, linestyle='dashed')
@@ -314,7 +1074,9 @@ def plot_data_series(data, plot_title, save_directory):
 
     # Save the plot
     plt.savefig(os.path.join(save_directory, f"{plot_title}.png"))
+    release_figure(fig)
 
+@instrumented
 def plot_mutual_information(pim_values, optimal_tau, plot_title, save_directory):
     """
     Plots mutual information graph and saves it to a specified directory. The optimal 
@@ -325,10 +1087,12 @@ def plot_mutual_information(pim_values, optimal_tau, plot_title, save_directory)
     :param plot_title: Title for the plot.
     :param save_directory: Directory to save the plot.
     """
+    import matplotlib.pyplot as plt
+
     # Tau values corresponding to the mutual information values
     tau_values = range(1, len(pim_values) + 1)
     # Create the plot
-    plt.figure()
+    fig = plt.figure()
     plt.plot(tau_values, pim_values)
     # Mark the optimal Tau value
     plt.axvline(x=optimal_tau, color='red', linestyle='--', label=f'Optimal Tau: {optimal_tau}')
@@ -341,73 +1105,207 @@ def plot_mutual_information(pim_values, optimal_tau, plot_title, save_directory)
     os.makedirs(save_directory, exist_ok=True)
     # Save the plot
     plt.savefig(os.path.join(save_directory, f"AMI_{plot_title}.png"))
+    release_figure(fig)
 
-if __name__ == "__main__":
+@instrumented
+def render_plots(plot_jobs, headless=True):
+    """
+    Renders a list of plot jobs collected by analyze_recording. Passing the jobs to this
+    function in another process (e.g. through a ProcessPoolExecutor) moves the plotting
+    out of the analysis.
+
+    :param plot_jobs: List of (plot function name, positional arguments) tuples.
+    :param headless: If True, renders with configure_plotting(headless=True).
+    """
+    if headless:
+        configure_plotting(headless=True)
+
+    for function_name, arguments in plot_jobs:
+        globals()[function_name](*arguments)
+
+def is_recording(file_path):
+    """
+    Tells whether a text file is a recording, i.e. whether its first non-empty line is
+    'timestamp : value'. Only the start of the file is read.
+
+    :param file_path: Path to the file.
+    :return: True if the file looks like a recording.
+    """
+    with open(file_path, "r", errors="replace") as file:
+
+        for line in file:
+            tokens = line.split()
+
+            if not tokens:
+                continue
+
+            if len(tokens) != 3 or tokens[1] != ":":
+                return False
+
+            try:
+                float(tokens[0])
+                float(tokens[2])
+            except ValueError:
+                return False
+
+            return True
+
+    return False
+
+def find_recordings(main_directory):
+    """
+    Finds every ECG and PPG recording below a data directory. Recordings are the
+    '.txt' files inside directories named 'ECG' or 'PPG' whose content is
+    'timestamp : value' lines; other text files, such as a readme, are skipped.
+
+    :param main_directory: Root of the data tree, e.g. 'Data'.
+    :return: Sorted list of recording paths.
+    """
+    recordings = []
 
-    main_directory = "Data"
-    
     # Iterate through the directory tree
     for root, dirs, files in os.walk(main_directory):
 
-        for dir_name in dirs:
+        # Check if the directory name is either 'ECG' or 'PPG'
+        if os.path.basename(root) in ["ECG", "PPG"]:
+
+            for file_name in files:
 
-            # Check if the directory name is either 'ECG' or 'PPG'
-            if dir_name in ["ECG", "PPG"]:
+                file_path = os.path.join(root, file_name)
 
-                directory_path = os.path.join(root, dir_name)
-                img_directory = os.path.join(directory_path, "Img")
+                if file_name.endswith(".txt") and is_recording(file_path):
+                    recordings.append(file_path)
 
-                # Check if the 'Img' directory exists, if not, create it
-                if not os.path.exists(img_directory):
-                    os.makedirs(img_directory)
+    return sorted(recordings)
+
+def run_stage(cache, stage, samples_fingerprint, parameters, compute):
+    """
+    Runs one analysis stage through a StageCache, or directly if there is no cache.
+
+    :param cache: Optional; StageCache holding earlier results.
+    :param stage: Name of the stage.
+    :param samples_fingerprint: Fingerprint of the input samples (see fingerprint_samples).
+    :param parameters: Dictionary with every parameter the stage result depends on.
+    :param compute: Function without arguments that computes the stage result.
+    :return: The stage result.
+    """
+    if cache is None:
+        return compute()
 
-                # Loop through each file in the directory
-                for file_name in os.listdir(directory_path):
+    return cache.run(stage, samples_fingerprint, parameters, compute)
 
-                    if file_name.endswith(".txt"):
+def analyze_recording(data_file_path, img_directory=None, max_delay_taumax=16, num_partitions=2, max_embedding_dimension=10, relative_tolerance=10, absolute_tolerance=2, defer_plots=False, cache=None):
+    """
+    Runs the full chaos analysis on one recording: auto mutual information, false
+    nearest neighbors, phase space reconstruction and the nonlinear complexity measures.
 
-                        # Full process for each file
-                        data_file_path = os.path.join(directory_path, file_name)
+    :param data_file_path: Path to the recording.
+    :param img_directory: Optional; directory for the plots. No plots are made if None.
+    :param max_delay_taumax: The maximum delay for the mutual information calculation.
+    :param num_partitions: The number of partitions for the mutual information calculation.
+    :param max_embedding_dimension: The maximum embedding dimension to consider.
+    :param relative_tolerance: The relative tolerance for nearest neighbor search.
+    :param absolute_tolerance: The absolute tolerance for nearest neighbor search.
+    :param defer_plots: If True, the plots are not drawn but returned under 'plot_jobs'
+                        for render_plots.
+    :param cache: Optional; StageCache. Each stage is keyed by the samples and the inputs
+                  it depends on, so e.g. a new absolute_tolerance reuses the cached AMI.
+    :return: Dictionary with the optimal delay, embedding dimension and complexity measures.
+    """
+    # Attribute the instrumentation records of this run to the recording
+    with instrumentation.recording(data_file_path), instrumentation.stage("analyze_recording"):
+
+        # Read data from the provided file path
+        time_series_data = read_data_from_file(data_file_path)
+        samples_fingerprint = fingerprint_samples(time_series_data) if cache is not None else None
+
+        # Extract the file name without extension for use in plot titles
+        plot_title = os.path.basename(data_file_path).split('.')[0]
+
+        # Calculate auto mutual information
+        mutual_info_values, optimal_delay = run_stage(cache, "ami", samples_fingerprint,
+            {"maximum_delay": max_delay_taumax, "number_of_partitions": num_partitions},
+            lambda: calculate_auto_mutual_information(time_series_data, max_delay_taumax, num_partitions))
+
+        # Estimate the embedding dimension
+        fnn_values, estimated_embedding_dimension, dimension_list = run_stage(cache, "fnn", samples_fingerprint,
+            {"delay": optimal_delay, "max_embedding_dimension": max_embedding_dimension, "relative_tolerance": relative_tolerance, "absolute_tolerance": absolute_tolerance},
+            lambda: knn_dimension_estimation(time_series_data, optimal_delay, max_embedding_dimension, relative_tolerance, absolute_tolerance))
+
+        # Calculate complexity measures
+        embedding_parameters = {"embedding_dimension": estimated_embedding_dimension, "delay": optimal_delay, "random_state": RANSAC_RANDOM_STATE}
+        correlation_dim = run_stage(cache, "correlation_dimension", samples_fingerprint, dict(embedding_parameters, max_reference_points=CORRELATION_REFERENCE_POINTS),
+            lambda: correlation_dimension(time_series_data, estimated_embedding_dimension, optimal_delay, random_state=RANSAC_RANDOM_STATE))
+        lyapunov_exp = run_stage(cache, "lyapunov_exponent", samples_fingerprint, embedding_parameters,
+            lambda: largest_lyapunov_exponent(time_series_data, estimated_embedding_dimension, optimal_delay, random_state=RANSAC_RANDOM_STATE))
+        hurst_exp = run_stage(cache, "hurst_exponent", samples_fingerprint, {"random_state": RANSAC_RANDOM_STATE},
+            lambda: hurst_exponent(time_series_data, RANSAC_RANDOM_STATE))
+
+        results = {
+            "file": data_file_path,
+            "tau": int(optimal_delay),
+            "embedding_dimension": int(estimated_embedding_dimension),
+            "lyapunov_exponent": float(lyapunov_exp),
+            "correlation_dimension": float(correlation_dim),
+            "hurst_exponent": float(hurst_exp),
+        }
+
+        if img_directory is not None:
+
+            # Initial segment of the series, AMI, FNN and the (subsampled) attractor
+            reconstructed_phase_space = phase_space_reconstruction(time_series_data, estimated_embedding_dimension, optimal_delay, copy=False)
+            plot_jobs = [
+                ("plot_data_series", (time_series_data[:2400], plot_title, img_directory)),
+                ("plot_mutual_information", (mutual_info_values, optimal_delay, plot_title, img_directory)),
+                ("plot_FNN", (fnn_values, estimated_embedding_dimension, dimension_list, plot_title, img_directory)),
+                ("plot_attractor", (np.array(subsample_points(reconstructed_phase_space, 20000)), plot_title, img_directory)),
+            ]
+
+            if defer_plots:
+                results["plot_jobs"] = plot_jobs
+            else:
+                render_plots(plot_jobs, headless=HEADLESS_PLOTTING)
+
+        return results
+
+
+if __name__ == "__main__":
+
+    main_directory = "Data"
 
-                        # Read data from the provided file path
-                        time_series_data = read_data_from_file(data_file_path)
+    # '--headless' saves the plots without opening windows, '--no-plots' skips them
+    plots_enabled = "--no-plots" not in sys.argv
 
-                        # Extract the file name without extension for use in plot titles
-                        plot_title = os.path.basename(data_file_path).split('.')[0]
+    if "--headless" in sys.argv:
+        configure_plotting(headless=True)
 
-                        # Plotting the initial segment of the time series data
-                        plot_data_series(time_series_data[:2400], plot_title, img_directory)
+    # '--instrument=FILE' records every stage to a .jsonl/.csv file, '--profile=DIR' adds cProfile dumps of the hot stages
+    options = dict(argument.split("=", 1) for argument in sys.argv[1:] if argument.startswith("--") and "=" in argument)
 
-                        # Parameters for auto mutual information calculation
-                        max_delay_taumax = 16
-                        num_partitions = 2
+    if "--instrument" in options or "--profile" in options:
+        recorder = instrumentation.enable(options.get("--instrument"), profile_directory=options.get("--profile"))
 
-                        # Calculate and plot auto mutual information
-                        mutual_info_values, optimal_delay = calculate_auto_mutual_information(time_series_data, max_delay_taumax, num_partitions)
-                        plot_mutual_information(mutual_info_values, optimal_delay, plot_title, img_directory)
+    # Loop through each ECG and PPG recording
+    for data_file_path in find_recordings(main_directory):
 
-                        # Parameters for K-nearest neighbors method
-                        max_embedding_dimension = 10
-                        relative_tolerance = 10
-                        absolute_tolerance = 2
+        img_directory = None
 
-                        # Estimate the embedding dimension and plot results
-                        fnn_values, estimated_embedding_dimension, dimension_list = knn_dimension_estimation(time_series_data, optimal_delay, max_embedding_dimension, relative_tolerance, absolute_tolerance)
-                        plot_FNN(fnn_values, estimated_embedding_dimension, dimension_list, plot_title, img_directory)
+        # Check if the 'Img' directory exists, if not, create it
+        if plots_enabled:
+            img_directory = os.path.join(os.path.dirname(data_file_path), "Img")
+            os.makedirs(img_directory, exist_ok=True)
 
-                        # Output the optimal delay and embedding dimension
-                        print(plot_title, "--- Optimal Delay T: ", optimal_delay)
-                        print(plot_title, "--- Estimated Embedding Dimension D: ", estimated_embedding_dimension)
-                        print("")
+        # Full process for each file
+        results = analyze_recording(data_file_path, img_directory)
+        plot_title = os.path.basename(data_file_path).split('.')[0]
 
-                        # Perform phase space reconstruction and plot the attractor
-                        reconstructed_phase_space = phase_space_reconstruction(time_series_data, estimated_embedding_dimension, optimal_delay)
-                        plot_attractor(reconstructed_phase_space, plot_title, img_directory)
+        # Output the optimal delay, embedding dimension and complexity measures
+        print(plot_title, "--- Optimal Delay T: ", results["tau"])
+        print(plot_title, "--- Estimated Embedding Dimension D: ", results["embedding_dimension"])
+        print("")
+        print(plot_title, "--- Lyapunov Exponent: ", results["lyapunov_exponent"])
+        print(plot_title, "--- Correlation Dimension: ", results["correlation_dimension"])
+        print(plot_title, "--- Hurst Exponent: ", results["hurst_exponent"])
 
-                        # Calculate and print complexity measures
-                        correlation_dim = nolds.corr_dim(time_series_data, estimated_embedding_dimension)
-                        lyapunov_exp = nolds.lyap_r(time_series_data, estimated_embedding_dimension)
-                        hurst_exp = nolds.hurst_rs(time_series_data)
-                        print(plot_title, "--- Lyapunov Exponent: ", lyapunov_exp)
-                        print(plot_title, "--- Correlation Dimension: ", correlation_dim)
-                        print(plot_title, "--- Hurst Exponent: ", hurst_exp)
\ No newline at end of file
+    if instrumentation.disable() is not None:
+        print(instrumentation.format_summary(recorder.records))
@@ -0,0 +1,208 @@
+import os
+import csv
+import sys
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from atractor_v10 import analyze_recording, configure_plotting, find_recordings, render_plots
+from stage_cache import StageCache
+import instrumentation
+
+PARAMETER_FIELDS = ["max_delay_taumax", "num_partitions", "max_embedding_dimension", "relative_tolerance", "absolute_tolerance"]
+RESULT_FIELDS = ["tau", "embedding_dimension", "lyapunov_exponent", "correlation_dimension", "hurst_exponent"]
+MANIFEST_FIELDS = ["file"] + PARAMETER_FIELDS + RESULT_FIELDS
+
+# StageCaches opened by this worker process, reused across its recordings
+_worker_caches = {}
+
+def parse_arguments(argv=None):
+    """
+    Parses the command line of the batch driver.
+
+    :param argv: Optional; list of arguments, defaults to sys.argv.
+    :return: argparse namespace with the data directory, manifest, job count and analysis parameters.
+    """
+    parser = argparse.ArgumentParser(description="Run the chaos analysis over every ECG/PPG recording of a data directory.")
+    parser.add_argument("data_directory", nargs="?", default="Data", help="Root of the data tree (default: Data).")
+    parser.add_argument("--manifest", default=None, help="Results manifest CSV (default: <data_directory>/results_manifest.csv).")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count(), help="Number of worker processes.")
+    parser.add_argument("--taumax", dest="max_delay_taumax", type=int, default=16, help="Maximum delay for the auto mutual information.")
+    parser.add_argument("--partitions", dest="num_partitions", type=int, default=2, help="Number of partitions for the auto mutual information.")
+    parser.add_argument("--max-dimension", dest="max_embedding_dimension", type=int, default=10, help="Maximum embedding dimension for FNN.")
+    parser.add_argument("--rtol", dest="relative_tolerance", type=float, default=10, help="Relative tolerance for FNN.")
+    parser.add_argument("--atol", dest="absolute_tolerance", type=float, default=2, help="Absolute tolerance for FNN.")
+    parser.add_argument("--cache", default=None, help="Directory of the stage result cache; unchanged stages are not recomputed.")
+    parser.add_argument("--cache-size", type=float, default=512, help="Size cap of the stage result cache in MB (default: 512).")
+    parser.add_argument("--instrument", default=None, help="Directory for per-stage timing and memory records (one JSON-lines file per worker); a summary is printed at the end.")
+    parser.add_argument("--profile", default=None, help="Directory for cProfile dumps of the hot stages of every recording.")
+    parser.add_argument("--plots", choices=["none", "inline", "deferred"], default="none", help="Save the plots of each recording to its 'Img' directory, drawn by the analysis workers ('inline') or by a separate plotting process ('deferred').")
+
+    return parser.parse_args(argv)
+
+def manifest_key(file_path, parameters):
+    """
+    Builds the key that identifies a manifest row: the recording and the parameters it was analyzed with.
+
+    :param file_path: Path to the recording.
+    :param parameters: Dictionary with the analysis parameters.
+    :return: Tuple usable as a set member.
+    """
+    return (os.path.normpath(file_path),) + tuple(float(parameters[field]) for field in PARAMETER_FIELDS)
+
+def read_manifest(manifest_path):
+    """
+    Reads the keys of the recordings already present in a results manifest.
+
+    :param manifest_path: Path to the manifest CSV.
+    :return: Set of manifest keys, empty if the manifest does not exist.
+    """
+    completed = set()
+
+    if not os.path.exists(manifest_path):
+        return completed
+
+    with open(manifest_path, "r", newline="") as manifest_file:
+
+        for row in csv.DictReader(manifest_file):
+            completed.add(manifest_key(row["file"], row))
+
+    return completed
+
+def worker_cache(cache_directory, cache_bytes):
+    """
+    Returns the StageCache of a worker process, opening it on first use, so the store
+    is measured once per worker rather than once per recording.
+
+    :param cache_directory: Optional; directory of the StageCache.
+    :param cache_bytes: Size cap of the StageCache in bytes.
+    :return: StageCache, or None without a cache directory.
+    """
+    if cache_directory is None:
+        return None
+
+    if (cache_directory, cache_bytes) not in _worker_caches:
+        _worker_caches[(cache_directory, cache_bytes)] = StageCache(cache_directory, cache_bytes)
+
+    return _worker_caches[(cache_directory, cache_bytes)]
+
+def analyze_for_manifest(file_path, parameters, plots, cache_directory=None, cache_bytes=None, instrument_directory=None, profile_directory=None):
+    """
+    Worker entry point: analyzes one recording and returns its manifest row.
+
+    :param file_path: Path to the recording.
+    :param parameters: Dictionary with the analysis parameters.
+    :param plots: 'none', 'inline' to draw the plots in this worker, or 'deferred' to
+                  return them under 'plot_jobs'.
+    :param cache_directory: Optional; directory of the StageCache shared by the workers.
+    :param cache_bytes: Size cap of the StageCache in bytes.
+    :param instrument_directory: Optional; directory for the stage records of this worker.
+    :param profile_directory: Optional; directory for cProfile dumps of the hot stages.
+    :return: Dictionary with the manifest fields.
+    """
+    img_directory = None
+    cache = worker_cache(cache_directory, cache_bytes)
+
+    # Workers are reused across recordings, so each one opens its records file once
+    if (instrument_directory is not None or profile_directory is not None) and instrumentation.active_recorder() is None:
+        records_path = os.path.join(instrument_directory, f"stages-{os.getpid()}.jsonl") if instrument_directory is not None else None
+        instrumentation.enable(records_path, track_memory=instrument_directory is not None, profile_directory=profile_directory)
+
+    if plots != "none":
+
+        # Render off-screen so worker processes never block on a window
+        configure_plotting(headless=True)
+        img_directory = os.path.join(os.path.dirname(file_path), "Img")
+
+    results = analyze_recording(file_path, img_directory, defer_plots=plots == "deferred", cache=cache, **parameters)
+    results.update(parameters)
+
+    return results
+
+def run_batch(data_directory, manifest_path, parameters, jobs=None, plots="none", cache_directory=None, cache_bytes=512 * 1024 * 1024, instrument_directory=None, profile_directory=None):
+    """
+    Analyzes every recording of a data directory that is not yet in the manifest, fanning
+    the recordings out over a process pool. Each result is appended to the manifest as
+    soon as it completes, so an interrupted run resumes where it stopped.
+
+    :param data_directory: Root of the data tree.
+    :param manifest_path: Path to the results manifest CSV.
+    :param parameters: Dictionary with the analysis parameters.
+    :param jobs: Number of worker processes, defaults to the number of CPUs.
+    :param plots: 'none', 'inline' or 'deferred'; see analyze_for_manifest.
+    :param cache_directory: Optional; directory of the stage result cache.
+    :param cache_bytes: Size cap of the stage result cache in bytes.
+    :param instrument_directory: Optional; directory for the per-stage records of the workers.
+    :param profile_directory: Optional; directory for cProfile dumps of the hot stages.
+    :return: Tuple containing the number of recordings analyzed and the number that failed.
+    """
+    completed = read_manifest(manifest_path)
+    pending = [file_path for file_path in find_recordings(data_directory) if manifest_key(file_path, parameters) not in completed]
+
+    analyzed = 0
+    failed = 0
+
+    # Created even when nothing is pending, so the summary of earlier records can be read
+    if instrument_directory is not None:
+        os.makedirs(instrument_directory, exist_ok=True)
+
+    if not pending:
+        return analyzed, failed
+
+    write_header = not os.path.exists(manifest_path) or os.path.getsize(manifest_path) == 0
+
+    # Deferred plots are drawn by one extra process while the analysis continues
+    plot_executor = ProcessPoolExecutor(max_workers=1) if plots == "deferred" else None
+    plot_futures = []
+
+    with open(manifest_path, "a", newline="") as manifest_file, ProcessPoolExecutor(max_workers=jobs) as executor:
+        writer = csv.DictWriter(manifest_file, fieldnames=MANIFEST_FIELDS, extrasaction="ignore")
+
+        if write_header:
+            writer.writeheader()
+
+        futures = {executor.submit(analyze_for_manifest, file_path, parameters, plots, cache_directory, cache_bytes, instrument_directory, profile_directory): file_path for file_path in pending}
+
+        for future in as_completed(futures):
+            file_path = futures[future]
+
+            try:
+                results = future.result()
+            except Exception as error:
+                # Failed recordings stay out of the manifest and are retried on the next run
+                print(f"{file_path} --- failed: {error}", file=sys.stderr)
+                failed += 1
+                continue
+
+            if plot_executor is not None:
+                plot_futures.append(plot_executor.submit(render_plots, results.pop("plot_jobs")))
+
+            writer.writerow(results)
+            manifest_file.flush()
+            analyzed += 1
+
+            print(f"{file_path} --- T: {results['tau']} D: {results['embedding_dimension']}")
+
+    if plot_executor is not None:
+
+        for plot_future in plot_futures:
+
+            if plot_future.exception() is not None:
+                print(f"Plotting failed: {plot_future.exception()}", file=sys.stderr)
+
+        plot_executor.shutdown()
+
+    return analyzed, failed
+
+if __name__ == "__main__":
+
+    arguments = parse_arguments()
+    parameters = {field: getattr(arguments, field) for field in PARAMETER_FIELDS}
+    manifest_path = arguments.manifest or os.path.join(arguments.data_directory, "results_manifest.csv")
+
+    analyzed, failed = run_batch(arguments.data_directory, manifest_path, parameters, arguments.jobs, arguments.plots, arguments.cache, int(arguments.cache_size * 1024 * 1024), arguments.instrument, arguments.profile)
+    print(f"Analyzed {analyzed} recordings, {failed} failed. Manifest: {manifest_path}")
+
+    if arguments.instrument is not None:
+        print(instrumentation.format_summary(instrumentation.read_records(arguments.instrument)))
+
+    sys.exit(1 if failed else 0)
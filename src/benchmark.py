@@ -0,0 +1,513 @@
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import tracemalloc
+import subprocess
+import warnings
+import numpy as np
+
+from atractor_v10 import (calculate_auto_mutual_information, calculate_mutual_information_histogram, calculate_mutual_information,
+                          correlation_dimension, knn_dimension_estimation, largest_lyapunov_exponent, load_recording,
+                          parse_recording, phase_space_reconstruction)
+
+# Known invariants and the embedding used to measure them. Lyapunov exponents are per
+# unit of time; correlation dimensions are the accepted Grassberger-Procaccia values.
+# fnn_dimension is the minimal embedding dimension. The "fnn" stage checks it with the
+# pipeline defaults (the AMI delay and a tolerance of 2 standard deviations), exactly as
+# analyze_recording would report it, and is expected to fail for the Henon map and the
+# Rossler flow. The "fnn_tuned" stage checks it with the hand-tuned fnn_delay and
+# fnn_absolute_tolerance, which do recover it: the 2-standard-deviation default flags
+# most neighbors of the Henon map, and at short delays the flows already fall below the
+# FNN threshold in two dimensions. None skips the tuned check.
+SIGNALS = {
+    "henon": {"sampling_interval": 1, "delay": 1, "embedding_dimension": 2, "trajectory_length": 8, "fit_offset": 0,
+              "lyapunov_exponent": 0.419, "correlation_dimension": 1.21, "fnn_dimension": 2, "fnn_delay": 1, "fnn_absolute_tolerance": 10},
+    "lorenz": {"sampling_interval": 0.05, "delay": 3, "embedding_dimension": 5, "trajectory_length": 40, "fit_offset": 5,
+               "lyapunov_exponent": 0.906, "correlation_dimension": 2.05, "fnn_dimension": 3, "fnn_delay": 6, "fnn_absolute_tolerance": 10},
+    "rossler": {"sampling_interval": 0.05, "delay": 30, "embedding_dimension": 3, "trajectory_length": 100, "fit_offset": 0,
+                "lyapunov_exponent": 0.0714, "correlation_dimension": 2.0, "fnn_dimension": 3, "fnn_delay": 50, "fnn_absolute_tolerance": 10},
+    "ecg": {"sampling_interval": 0.005, "delay": None, "embedding_dimension": None, "trajectory_length": 20, "fit_offset": 0,
+            "lyapunov_exponent": None, "correlation_dimension": None, "fnn_dimension": None, "fnn_delay": None, "fnn_absolute_tolerance": None},
+    "ppg": {"sampling_interval": 0.005, "delay": None, "embedding_dimension": None, "trajectory_length": 20, "fit_offset": 0,
+            "lyapunov_exponent": None, "correlation_dimension": None, "fnn_dimension": None, "fnn_delay": None, "fnn_absolute_tolerance": None},
+    "ecg_adc": {"sampling_interval": 0.005, "delay": None, "embedding_dimension": None, "trajectory_length": 20, "fit_offset": 0,
+                "lyapunov_exponent": None, "correlation_dimension": None, "fnn_dimension": None, "fnn_delay": None, "fnn_absolute_tolerance": None},
+}
+
+# Largest input each stage is run on by default; larger sizes are recorded as skipped
+STAGE_SIZE_LIMITS = {
+    "parse": None,
+    "load_cached": None,
+    "ami": None,
+    "ami_reference": 10 ** 4,
+    "reconstruction_copy": None,
+    "reconstruction_view": None,
+    "fnn": 2 * 10 ** 5,
+    "fnn_tuned": 2 * 10 ** 5,
+    "correlation_dimension": 2 * 10 ** 5,
+    "lyapunov_exponent": 10 ** 5,
+    "correlation_dimension_1d": 5 * 10 ** 3,
+    "nolds_corr_dim": 5 * 10 ** 3,
+    "nolds_corr_dim_1d": 5 * 10 ** 3,
+    "nolds_lyap_r": 5 * 10 ** 3,
+}
+
+# Tolerances of the invariant checks
+LYAPUNOV_RELATIVE_TOLERANCE = 0.25
+CORRELATION_DIMENSION_TOLERANCE = 0.3
+NOLDS_RELATIVE_TOLERANCE = 1e-6
+
+# Mutual information settings of analyze_recording, used for the delay of the default FNN check
+PIPELINE_MAXIMUM_DELAY = 16
+PIPELINE_PARTITIONS = 2
+
+# Shorter series do not resolve the invariants; only the reference checks run on them
+MINIMUM_INVARIANT_CHECK_SIZE = 10 ** 4
+
+# Stages faster than this are dominated by timer noise and never count as regressions
+MINIMUM_COMPARED_WALL_TIME = 0.01
+
+def integrate_flow(derivative, initial_state, number_of_samples, sampling_interval, steps_per_sample, transient_samples):
+    """
+    Integrates a 3-D flow with a fixed-step fourth-order Runge-Kutta scheme and returns
+    its first coordinate.
+
+    :param derivative: Function (x, y, z) -> (dx, dy, dz).
+    :param initial_state: Initial (x, y, z).
+    :param number_of_samples: Number of samples returned.
+    :param sampling_interval: Time between samples.
+    :param steps_per_sample: Integration steps per sample.
+    :param transient_samples: Samples discarded before the returned series.
+    :return: NumPy array with the x coordinate.
+    """
+    x, y, z = initial_state
+    h = sampling_interval / steps_per_sample
+    samples = np.empty(number_of_samples)
+
+    for sample_index in range(-transient_samples, number_of_samples):
+
+        for _ in range(steps_per_sample):
+            k1 = derivative(x, y, z)
+            k2 = derivative(x + h / 2 * k1[0], y + h / 2 * k1[1], z + h / 2 * k1[2])
+            k3 = derivative(x + h / 2 * k2[0], y + h / 2 * k2[1], z + h / 2 * k2[2])
+            k4 = derivative(x + h * k3[0], y + h * k3[1], z + h * k3[2])
+            x += h / 6 * (k1[0] + 2 * k2[0] + 2 * k3[0] + k4[0])
+            y += h / 6 * (k1[1] + 2 * k2[1] + 2 * k3[1] + k4[1])
+            z += h / 6 * (k1[2] + 2 * k2[2] + 2 * k3[2] + k4[2])
+
+        if sample_index >= 0:
+            samples[sample_index] = x
+
+    return samples
+
+def lorenz_series(number_of_samples):
+    """
+    x coordinate of the Lorenz system (sigma=10, rho=28, beta=8/3) sampled every 0.05.
+    """
+    return integrate_flow(lambda x, y, z: (10 * (y - x), x * (28 - z) - y, x * y - 8 / 3 * z), (1.0, 1.0, 1.0), number_of_samples, 0.05, 5, 500)
+
+def rossler_series(number_of_samples):
+    """
+    x coordinate of the Rössler system (a=0.2, b=0.2, c=5.7) sampled every 0.05.
+    """
+    return integrate_flow(lambda x, y, z: (-y - z, x + 0.2 * y, 0.2 + z * (x - 5.7)), (1.0, 1.0, 0.0), number_of_samples, 0.05, 2, 2000)
+
+def henon_series(number_of_samples):
+    """
+    x coordinate of the Hénon map (a=1.4, b=0.3).
+    """
+    x, y = 0.1, 0.0
+    samples = np.empty(number_of_samples)
+
+    for sample_index in range(-1000, number_of_samples):
+        x, y = 1 - 1.4 * x * x + y, 0.3 * x
+
+        if sample_index >= 0:
+            samples[sample_index] = x
+
+    return samples
+
+def pulse_train(number_of_samples, sampling_rate, waves, random_generator, noise_level):
+    """
+    Sums Gaussian waves repeated every beat, with beat-to-beat jitter, baseline wander and
+    white noise, as a stand-in for ECG/PPG recordings.
+
+    :param number_of_samples: Number of samples.
+    :param sampling_rate: Sampling rate in Hz.
+    :param waves: List of (offset in beat fractions, width in seconds, amplitude) tuples.
+    :param random_generator: NumPy random generator.
+    :param noise_level: Standard deviation of the white noise.
+    :return: NumPy array with the synthetic signal.
+    """
+    duration = number_of_samples / sampling_rate
+    times = np.arange(number_of_samples) / sampling_rate
+
+    # Beat onsets around 72 bpm with 5% jitter
+    beat_periods = 60 / 72 * (1 + 0.05 * random_generator.standard_normal(int(duration / 0.5) + 2))
+    beat_onsets = np.cumsum(beat_periods) - beat_periods[0]
+    beat_onsets = beat_onsets[beat_onsets < duration + 1]
+
+    signal = 0.1 * np.sin(2 * np.pi * 0.25 * times)
+
+    for onset, period in zip(beat_onsets, beat_periods):
+        first = max(int((onset - 0.5) * sampling_rate), 0)
+        last = min(int((onset + period + 0.5) * sampling_rate), number_of_samples)
+
+        for offset, width, amplitude in waves:
+            signal[first:last] += amplitude * np.exp(-0.5 * ((times[first:last] - onset - offset * period) / width) ** 2)
+
+    return signal + noise_level * random_generator.standard_normal(number_of_samples)
+
+def ecg_like_series(number_of_samples, seed=0):
+    """
+    Noisy ECG-like signal at 200 Hz with P, Q, R, S and T waves.
+    """
+    waves = [(0.2, 0.025, 0.15), (0.35, 0.01, -0.1), (0.38, 0.012, 1.0), (0.41, 0.01, -0.25), (0.65, 0.04, 0.3)]
+
+    return pulse_train(number_of_samples, 200, waves, np.random.default_rng(seed), 0.02)
+
+def ppg_like_series(number_of_samples, seed=0):
+    """
+    Noisy PPG-like signal at 200 Hz with a systolic peak and a dicrotic wave.
+    """
+    waves = [(0.3, 0.08, 1.0), (0.6, 0.1, 0.4)]
+
+    return pulse_train(number_of_samples, 200, waves, np.random.default_rng(seed), 0.01)
+
+def ecg_adc_series(number_of_samples, seed=0):
+    """
+    ECG-like signal quantized to 12-bit ADC counts, like the recordings of the ESP32.
+    Integer samples give equally distant neighbors, which exercise the tie-breaking of
+    the neighbor searches.
+    """
+    return np.clip(np.round(1800 + 1800 * ecg_like_series(number_of_samples, seed)), 0, 4095)
+
+GENERATORS = {"henon": henon_series, "lorenz": lorenz_series, "rossler": rossler_series, "ecg": ecg_like_series, "ppg": ppg_like_series,
+              "ecg_adc": ecg_adc_series}
+
+def generate_signal(signal_name, number_of_samples, cache_directory=None):
+    """
+    Generates a benchmark signal, reusing a cached copy when one is available. Longer
+    cached series are truncated, since every generator is deterministic.
+
+    :param signal_name: One of the keys of GENERATORS.
+    :param number_of_samples: Number of samples.
+    :param cache_directory: Optional; directory of generated series.
+    :return: NumPy array with the signal.
+    """
+    if cache_directory is not None:
+        os.makedirs(cache_directory, exist_ok=True)
+
+        for file_name in sorted(os.listdir(cache_directory)):
+            name, _, length = os.path.splitext(file_name)[0].rpartition("_")
+
+            if name == signal_name and length.isdigit() and int(length) >= number_of_samples:
+                return np.load(os.path.join(cache_directory, file_name))[:number_of_samples]
+
+    samples = GENERATORS[signal_name](number_of_samples)
+
+    if cache_directory is not None:
+        np.save(os.path.join(cache_directory, f"{signal_name}_{number_of_samples}.npy"), samples)
+
+    return samples
+
+def measure(function, track_memory):
+    """
+    Runs a function once and measures it.
+
+    :param function: Function without arguments.
+    :param track_memory: If True, runs the function a second time under tracemalloc to
+                         record the peak of Python and NumPy allocations.
+    :return: Tuple containing the function output and a dictionary of measurements.
+    """
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+    output = function()
+    measurements = {"wall_time": time.perf_counter() - wall_start, "cpu_time": time.process_time() - cpu_start}
+
+    if track_memory:
+        tracemalloc.start()
+        function()
+        measurements["peak_memory_bytes"] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    return output, measurements
+
+def check_close(value, expected, tolerance, relative=False):
+    """
+    Builds the record of an invariant check.
+    """
+    if expected is None or value is None:
+        return None
+
+    error = abs(value - expected) / abs(expected) if relative else abs(value - expected)
+
+    return {"expected": expected, "tolerance": tolerance, "relative": relative, "passed": bool(error <= tolerance)}
+
+def benchmark_signal(signal_name, time_series_data, work_directory, stage_size_limits, track_memory):
+    """
+    Times every pipeline stage on one signal and checks its outputs.
+
+    :param signal_name: One of the keys of SIGNALS.
+    :param time_series_data: The signal.
+    :param work_directory: Scratch directory for the text recording.
+    :param stage_size_limits: Dictionary with the largest input of each stage.
+    :param track_memory: If True, records the peak memory of each stage.
+    :return: List of result dictionaries, one per stage.
+    """
+    invariants = SIGNALS[signal_name]
+    number_of_samples = len(time_series_data)
+    results = []
+
+    def add_result(stage, function, check=None, invariant=False):
+        limit = stage_size_limits.get(stage)
+        record = {"signal": signal_name, "size": number_of_samples, "stage": stage}
+
+        if limit is not None and number_of_samples > limit:
+            record["skipped"] = True
+            results.append(record)
+            return None
+
+        try:
+            output, measurements = measure(function, track_memory)
+        except (ValueError, MemoryError) as error:
+            # E.g. too few points for the Theiler window; recorded instead of aborting the suite
+            record["error"] = str(error)
+            results.append(record)
+            return None
+
+        record.update(measurements)
+        record["output"] = output
+
+        if check is not None and not (invariant and number_of_samples < MINIMUM_INVARIANT_CHECK_SIZE):
+            record["check"] = check(output)
+
+        results.append(record)
+        print(f"{signal_name:>8} {number_of_samples:>8} {stage:<22} {measurements['wall_time']:9.4f} s", file=sys.stderr)
+
+        return output
+
+    # Parsing the 'timestamp : value' text format and reloading it from the binary cache
+    recording_path = os.path.join(work_directory, f"{signal_name}_{number_of_samples}.txt")
+    timestamps = np.arange(number_of_samples) * int(invariants["sampling_interval"] * 1000 or 1)
+
+    with open(recording_path, "w") as recording_file:
+        recording_file.write("".join(f"{timestamp} : {value!r}\n" for timestamp, value in zip(timestamps.tolist(), time_series_data.tolist())))
+
+    add_result("parse", lambda: len(parse_recording(recording_path)[1]))
+    load_recording(recording_path)
+    add_result("load_cached", lambda: len(load_recording(recording_path)[1]))
+
+    # Auto mutual information, checked against the per-partition reference engine
+    maximum_delay, number_of_partitions = 32, 16
+    ami_output = add_result("ami", lambda: int(calculate_auto_mutual_information(time_series_data, maximum_delay, number_of_partitions)[1]))
+
+    def ami_reference():
+        normalized = (time_series_data - np.min(time_series_data)) / (np.max(time_series_data) - np.min(time_series_data))
+        reference = calculate_mutual_information(normalized, range(1, maximum_delay + 1), number_of_partitions, number_of_samples)
+        histogram = calculate_mutual_information_histogram(normalized, range(1, maximum_delay + 1), number_of_partitions, number_of_samples)
+        return float(np.max(np.abs(np.asarray(reference) - np.asarray(histogram))))
+
+    add_result("ami_reference", ami_reference, lambda difference: {"expected": 0.0, "tolerance": 1e-12, "relative": False, "passed": bool(difference <= 1e-12)})
+
+    delay = invariants["delay"] or ami_output or 1
+
+    # False nearest neighbors with the pipeline defaults of analyze_recording, which need not find the minimal dimension
+    pipeline_delay = int(calculate_auto_mutual_information(time_series_data, PIPELINE_MAXIMUM_DELAY, PIPELINE_PARTITIONS)[1])
+    fnn_output = add_result("fnn", lambda: int(knn_dimension_estimation(time_series_data, pipeline_delay, 10, 10, 2)[1]),
+        lambda dimension: check_close(dimension, invariants["fnn_dimension"], 0), invariant=True)
+
+    # False nearest neighbors with the hand-tuned delay and tolerance, which must find it exactly
+    if invariants["fnn_delay"] is not None:
+        add_result("fnn_tuned", lambda: int(knn_dimension_estimation(time_series_data, invariants["fnn_delay"], 10, 10, invariants["fnn_absolute_tolerance"])[1]),
+            lambda dimension: check_close(dimension, invariants["fnn_dimension"], 0), invariant=True)
+
+    embedding_dimension = invariants["embedding_dimension"] or fnn_output or 3
+
+    # Phase space reconstruction as a copy and as a strided view
+    add_result("reconstruction_copy", lambda: float(phase_space_reconstruction(time_series_data, embedding_dimension, delay).sum()))
+    add_result("reconstruction_view", lambda: float(phase_space_reconstruction(time_series_data, embedding_dimension, delay, copy=False).sum()))
+
+    # Nonlinear invariants
+    native_corr_dim = add_result("correlation_dimension", lambda: float(correlation_dimension(time_series_data, embedding_dimension, delay, fit="poly")),
+        lambda value: check_close(value, invariants["correlation_dimension"], CORRELATION_DIMENSION_TOLERANCE), invariant=True)
+
+    def lyapunov():
+        return float(largest_lyapunov_exponent(time_series_data, embedding_dimension, delay, trajectory_length=invariants["trajectory_length"],
+                                               fit="poly", fit_offset=invariants["fit_offset"], sampling_interval=invariants["sampling_interval"]))
+
+    native_lyapunov = add_result("lyapunov_exponent", lyapunov, lambda value: check_close(value, invariants["lyapunov_exponent"], LYAPUNOV_RELATIVE_TOLERANCE, relative=True), invariant=True)
+
+    # nolds baselines on small inputs, which the native implementations must reproduce
+    import nolds
+
+    add_result("nolds_corr_dim", lambda: float(nolds.corr_dim(time_series_data, embedding_dimension, lag=delay, fit="poly")),
+        lambda value: check_close(native_corr_dim, value, NOLDS_RELATIVE_TOLERANCE, relative=True))
+
+    # A one-dimensional embedding, where the reconstruction is a read-only view of the series
+    native_corr_dim_1d = add_result("correlation_dimension_1d", lambda: float(correlation_dimension(time_series_data, 1, delay, fit="poly")))
+    add_result("nolds_corr_dim_1d", lambda: float(nolds.corr_dim(time_series_data, 1, lag=delay, fit="poly")),
+        lambda value: check_close(native_corr_dim_1d, value, NOLDS_RELATIVE_TOLERANCE, relative=True))
+
+    def nolds_lyapunov():
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            return float(nolds.lyap_r(time_series_data, embedding_dimension, lag=delay, trajectory_len=invariants["trajectory_length"],
+                                      fit="poly", fit_offset=invariants["fit_offset"], tau=invariants["sampling_interval"]))
+
+    add_result("nolds_lyap_r", nolds_lyapunov, lambda value: check_close(native_lyapunov, value, NOLDS_RELATIVE_TOLERANCE, relative=True))
+
+    return results
+
+def environment_description():
+    """
+    Describes the machine and the code version the benchmark ran on.
+    """
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+
+    return {
+        "commit": commit,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+        "cpu_count": os.cpu_count(),
+    }
+
+def warm_imports():
+    """
+    Imports the libraries the pipeline loads lazily, so their one-time import cost is
+    not charged to the first stage that uses them.
+    """
+    import nolds
+    import sklearn.linear_model
+    import sklearn.neighbors
+
+def run_benchmarks(signal_names, sizes, stage_size_limits=None, track_memory=True, signal_cache_directory=None):
+    """
+    Runs the benchmark suite.
+
+    :param signal_names: Signals to benchmark, keys of SIGNALS.
+    :param sizes: Series lengths to benchmark.
+    :param stage_size_limits: Optional; overrides of STAGE_SIZE_LIMITS.
+    :param track_memory: If True, records the peak memory of each stage.
+    :param signal_cache_directory: Optional; directory of generated series.
+    :return: Dictionary with the environment description and the results.
+    """
+    limits = dict(STAGE_SIZE_LIMITS)
+    limits.update(stage_size_limits or {})
+    results = []
+    work_directory = tempfile.mkdtemp(prefix="chaos_benchmark_")
+
+    # Import sklearn and nolds before the first timed stage
+    warm_imports()
+
+    try:
+        for signal_name in signal_names:
+
+            # Generate the longest series once; shorter sizes are its prefixes
+            longest_series = generate_signal(signal_name, max(sizes), signal_cache_directory)
+
+            for number_of_samples in sorted(sizes):
+                results.extend(benchmark_signal(signal_name, longest_series[:number_of_samples], work_directory, limits, track_memory))
+    finally:
+        shutil.rmtree(work_directory, ignore_errors=True)
+
+    return {"environment": environment_description(), "results": results}
+
+def compare_reports(baseline, current, threshold=1.2):
+    """
+    Compares two benchmark reports stage by stage.
+
+    :param baseline: Earlier report.
+    :param current: New report.
+    :param threshold: Wall-time ratio above which a stage counts as a regression; stages
+                      under MINIMUM_COMPARED_WALL_TIME are listed but not judged.
+    :return: Tuple containing the comparison lines and the number of regressions
+             (slowdowns, newly failing checks and newly failing stages).
+    """
+    baseline_results = {(result["signal"], result["size"], result["stage"]): result for result in baseline["results"]}
+    lines = []
+    regressions = 0
+
+    for result in current["results"]:
+        key = (result["signal"], result["size"], result["stage"])
+        previous = baseline_results.get(key)
+
+        if previous is None or result.get("skipped") or previous.get("skipped"):
+            continue
+
+        # A stage that stopped working is a regression; one that started working has no timing to compare
+        if "error" in result:
+
+            if "error" not in previous:
+                regressions += 1
+                lines.append(f"{key[0]:>8} {key[1]:>8} {key[2]:<22} {previous['wall_time']:9.4f} s -> error: {result['error']} ERROR")
+
+            continue
+
+        if "error" in previous:
+            continue
+
+        ratio = result["wall_time"] / previous["wall_time"] if previous["wall_time"] > 0 else float("inf")
+        failed_check = result.get("check") is not None and not result["check"]["passed"]
+        newly_failed = failed_check and (previous.get("check") is None or previous["check"]["passed"])
+        flag = ""
+
+        if ratio > threshold and max(result["wall_time"], previous["wall_time"]) >= MINIMUM_COMPARED_WALL_TIME:
+            flag = " SLOWER"
+            regressions += 1
+
+        if newly_failed:
+            flag += " CHECK FAILED"
+            regressions += 1
+
+        lines.append(f"{key[0]:>8} {key[1]:>8} {key[2]:<22} {previous['wall_time']:9.4f} s -> {result['wall_time']:9.4f} s ({ratio:5.2f}x){flag}")
+
+    return lines, regressions
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Benchmark the pipeline stages on synthetic chaotic and ECG/PPG-like signals.")
+    parser.add_argument("--signals", nargs="+", default=list(SIGNALS), choices=list(SIGNALS), help="Signals to benchmark.")
+    parser.add_argument("--sizes", nargs="+", type=int, default=[10 ** 3, 10 ** 4, 10 ** 5, 10 ** 6], help="Series lengths.")
+    parser.add_argument("--output", default="benchmark_results.json", help="JSON report to write.")
+    parser.add_argument("--compare", default=None, help="Earlier JSON report to compare against.")
+    parser.add_argument("--threshold", type=float, default=1.2, help="Wall-time ratio reported as a regression (default: 1.2).")
+    parser.add_argument("--no-memory", action="store_true", help="Skip the tracemalloc pass of each stage.")
+    parser.add_argument("--signal-cache", default=".benchmark_signals", help="Directory of generated series (default: .benchmark_signals).")
+    parser.add_argument("--limit", nargs=2, action="append", metavar=("STAGE", "SIZE"), default=[], help="Override the largest input of a stage.")
+    arguments = parser.parse_args()
+
+    report = run_benchmarks(arguments.signals, arguments.sizes, {stage: int(size) for stage, size in arguments.limit}, not arguments.no_memory, arguments.signal_cache)
+
+    with open(arguments.output, "w") as output_file:
+        json.dump(report, output_file, indent=2)
+
+    failed_checks = [result for result in report["results"] if result.get("check") is not None and not result["check"]["passed"]]
+
+    for result in failed_checks:
+        print(f"Check failed: {result['signal']} {result['size']} {result['stage']} = {result['output']} (expected {result['check']['expected']})")
+
+    exit_code = 1 if failed_checks else 0
+
+    if arguments.compare is not None:
+
+        with open(arguments.compare, "r") as baseline_file:
+            lines, regressions = compare_reports(json.load(baseline_file), report, arguments.threshold)
+
+        print("\n".join(lines))
+        print(f"{regressions} regressions against {arguments.compare}")
+        exit_code = 1 if regressions else exit_code
+
+    print(f"Report written to {arguments.output}")
+    sys.exit(exit_code)
@@ -0,0 +1,282 @@
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import threading
+import socketserver
+from collections import OrderedDict
+import numpy as np
+
+from atractor_v10 import load_recording
+from sweep import DEFAULT_PARAMETERS, RecordingSweep
+from stage_cache import StageCache, fingerprint_samples
+
+class AnalysisService:
+    """
+    Answers analysis requests from a long-lived process. The heavy imports are loaded
+    once at start-up, and the RecordingSweep of each recently analyzed series is kept,
+    so its mutual information curves, neighbor queries and complexity measures are
+    reused by later requests for the same samples, whatever their parameters.
+
+    Requests and responses are JSON objects:
+
+        {"id": 1, "command": "analyze", "file": "Data/Test/ECG/ECG_V1.txt", "parameters": {"relative_tolerance": 15}}
+        {"id": 2, "command": "analyze", "samples": [512, 530, ...], "complexity": false}
+        {"id": 3, "command": "stats"}
+
+    Responses carry the request id, 'ok', and either 'result' or 'error', plus the
+    handling time in milliseconds. An analyze result has the fields of an
+    analyze_recording result plus the parameters used.
+    """
+
+    def __init__(self, max_recordings=16, cache=None):
+        """
+        :param max_recordings: Number of series whose shared work is kept in memory.
+        :param cache: Optional; StageCache for the complexity measures.
+        """
+        self.max_recordings = max_recordings
+        self.cache = cache
+        self.requests = 0
+        self.reused = 0
+        self._sweeps = OrderedDict()
+        self._lock = threading.Lock()
+
+    def warm_up(self):
+        """
+        Runs every stage once on a short synthetic series, so the lazily imported
+        modules are loaded before the first request.
+        """
+        time_values = np.arange(2000)
+        time_series_data = np.sin(0.07 * time_values) + 0.5 * np.sin(0.31 * time_values) + 0.1 * np.random.default_rng(0).standard_normal(2000)
+
+        RecordingSweep(time_series_data).run([dict(DEFAULT_PARAMETERS)])
+
+    def sweep_for(self, time_series_data):
+        """
+        Returns the RecordingSweep of a series, creating it if the samples are new and
+        dropping the least recently used one when max_recordings is exceeded.
+
+        :param time_series_data: The time series data.
+        :return: RecordingSweep of the series.
+        """
+        samples_fingerprint = fingerprint_samples(time_series_data)
+
+        if samples_fingerprint in self._sweeps:
+            self._sweeps.move_to_end(samples_fingerprint)
+            self.reused += 1
+            return self._sweeps[samples_fingerprint]
+
+        recording_sweep = RecordingSweep(time_series_data, self.cache)
+        self._sweeps[samples_fingerprint] = recording_sweep
+
+        if len(self._sweeps) > self.max_recordings:
+            self._sweeps.popitem(last=False)
+
+        return recording_sweep
+
+    def analyze(self, request):
+        """
+        Analyzes a recording or an array of samples.
+
+        :param request: Dictionary with 'file' or 'samples', and optionally 'parameters'
+                        (see DEFAULT_PARAMETERS) and 'complexity'.
+        :return: Dictionary with the parameters and the analysis results.
+        """
+        parameters = dict(DEFAULT_PARAMETERS)
+        unknown = set(request.get("parameters", {})) - set(parameters)
+
+        if unknown:
+            raise ValueError(f"Unknown parameters: {', '.join(sorted(unknown))}")
+
+        parameters.update(request.get("parameters", {}))
+
+        if "file" in request:
+            timestamps, time_series_data = load_recording(request["file"])
+        elif "samples" in request:
+            time_series_data = np.asarray(request["samples"], dtype=np.float64)
+        else:
+            raise ValueError("An analyze request needs 'file' or 'samples'")
+
+        result = self.sweep_for(time_series_data).run([parameters], request.get("complexity", True))[0]
+
+        if "file" in request:
+            result["file"] = request["file"]
+
+        return result
+
+    def handle(self, request):
+        """
+        Handles one request.
+
+        :param request: Request dictionary.
+        :return: Response dictionary.
+        """
+        start_time = time.perf_counter()
+        response = {"id": request.get("id") if isinstance(request, dict) else None}
+
+        # One request at a time; the shared work of a series is not thread-safe
+        with self._lock:
+            self.requests += 1
+
+            try:
+                if not isinstance(request, dict):
+                    raise ValueError("A request must be a JSON object")
+
+                command = request.get("command", "analyze")
+
+                if command == "analyze":
+                    response["result"] = self.analyze(request)
+                elif command == "ping":
+                    response["result"] = "pong"
+                elif command == "stats":
+                    response["result"] = {"requests": self.requests, "reused": self.reused, "recordings": len(self._sweeps)}
+                elif command == "shutdown":
+                    response["result"] = "bye"
+                else:
+                    raise ValueError(f"Unknown command: {command}")
+
+                response["ok"] = True
+
+            except Exception as error:
+                response["ok"] = False
+                response["error"] = f"{type(error).__name__}: {error}"
+
+        response["elapsed_ms"] = (time.perf_counter() - start_time) * 1000
+
+        return response
+
+def handle_line(service, line):
+    """
+    Decodes a JSON-lines request and handles it.
+
+    :param service: AnalysisService.
+    :param line: One line of text.
+    :return: Tuple containing the encoded response line and a flag telling whether the
+             request asked for a shutdown.
+    """
+    try:
+        request = json.loads(line)
+    except ValueError as error:
+        response = {"id": None, "ok": False, "error": f"Invalid JSON: {error}"}
+        return json.dumps(response) + "\n", False
+
+    response = service.handle(request)
+    shutdown = isinstance(request, dict) and request.get("command") == "shutdown"
+
+    return json.dumps(response) + "\n", shutdown
+
+def serve_stdio(service, input_stream=sys.stdin, output_stream=sys.stdout):
+    """
+    Serves JSON-lines requests from a stream until it closes or a shutdown request
+    arrives. Each response is written and flushed as one line.
+
+    :param service: AnalysisService.
+    :param input_stream: Stream of requests.
+    :param output_stream: Stream for the responses.
+    """
+    for line in input_stream:
+
+        if not line.strip():
+            continue
+
+        response_line, shutdown = handle_line(service, line)
+        output_stream.write(response_line)
+        output_stream.flush()
+
+        if shutdown:
+            break
+
+class _SocketHandler(socketserver.StreamRequestHandler):
+    """
+    Serves the JSON-lines requests of one socket connection.
+    """
+
+    def handle(self):
+
+        for line in self.rfile:
+
+            if not line.strip():
+                continue
+
+            response_line, shutdown = handle_line(self.server.service, line.decode())
+            self.wfile.write(response_line.encode())
+            self.wfile.flush()
+
+            if shutdown:
+                # shutdown() waits for serve_forever, so it cannot run on this thread's behalf
+                threading.Thread(target=self.server.shutdown, daemon=True).start()
+                break
+
+def serve_socket(service, socket_path):
+    """
+    Serves JSON-lines requests on a Unix socket, one thread per connection, until a
+    shutdown request arrives.
+
+    :param service: AnalysisService.
+    :param socket_path: Path of the socket; a stale socket file is replaced.
+    """
+    if os.path.exists(socket_path):
+        os.remove(socket_path)
+
+    server = socketserver.ThreadingUnixStreamServer(socket_path, _SocketHandler)
+    server.daemon_threads = True
+    server.service = service
+
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+
+def send_request(socket_path, request, timeout=None):
+    """
+    Sends one request to a daemon listening on a Unix socket.
+
+    :param socket_path: Path of the socket.
+    :param request: Request dictionary.
+    :param timeout: Optional; seconds to wait for the response.
+    :return: Response dictionary.
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        client.settimeout(timeout)
+        client.connect(socket_path)
+
+        with client.makefile("rwb") as stream:
+            stream.write((json.dumps(request) + "\n").encode())
+            stream.flush()
+
+            return json.loads(stream.readline())
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Long-lived analysis worker answering JSON-lines requests on stdin/stdout or a Unix socket.")
+    parser.add_argument("--socket", default=None, help="Listen on this Unix socket instead of stdin/stdout.")
+    parser.add_argument("--max-recordings", type=int, default=16, help="Number of series whose shared work is kept in memory (default: 16).")
+    parser.add_argument("--cache", default=None, help="Directory of the stage result cache shared with batch.py.")
+    parser.add_argument("--no-warm-up", action="store_true", help="Skip the start-up run that loads the heavy imports.")
+    parser.add_argument("--analyze", default=None, metavar="FILE", help="Client mode: ask the daemon on --socket to analyze FILE and print the result.")
+    arguments = parser.parse_args()
+
+    if arguments.analyze is not None:
+
+        if arguments.socket is None:
+            parser.error("--analyze needs --socket")
+
+        response = send_request(arguments.socket, {"command": "analyze", "file": os.path.abspath(arguments.analyze)})
+        print(json.dumps(response, indent=2))
+        sys.exit(0 if response["ok"] else 1)
+
+    service = AnalysisService(arguments.max_recordings, StageCache(arguments.cache) if arguments.cache is not None else None)
+
+    if not arguments.no_warm_up:
+        service.warm_up()
+
+    if arguments.socket is not None:
+        print(f"Analysis daemon listening on {arguments.socket}", file=sys.stderr)
+        serve_socket(service, arguments.socket)
+    else:
+        serve_stdio(service)
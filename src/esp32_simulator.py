@@ -0,0 +1,120 @@
+import os
+import tty
+import time
+import select
+import argparse
+import threading
+
+from atractor_v10 import load_recording
+
+class ESP32Simulator:
+    """
+    Pseudo-terminal stand-in for the ESP32 running PPG_V3.ino. It waits for an 'ECG'
+    or 'PPG' command and replays a recording as 'timestamp,value' lines, paced by the
+    recording's timestamps divided by speed. Open port_name with pyserial to talk to it.
+    """
+
+    def __init__(self, recordings=None, speed=1.0, corrupt_every=0):
+        """
+        :param recordings: Optional; dictionary mapping 'ECG'/'PPG' to recording paths.
+                           Defaults to the V1 recordings in Data/Test.
+        :param speed: Replay speed factor; 1.0 is real time.
+        :param corrupt_every: If positive, every n-th line is sent malformed.
+        """
+        data_directory = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Data", "Test")
+        self.recordings = {
+            "ECG": os.path.join(data_directory, "ECG", "ECG_V1.txt"),
+            "PPG": os.path.join(data_directory, "PPG", "PPG_V1.txt"),
+        }
+        self.recordings.update(recordings or {})
+        self.speed = speed
+        self.corrupt_every = corrupt_every
+
+        # The application opens the slave side; the simulator drives the master side
+        self._master_fd, self._slave_fd = os.openpty()
+        tty.setraw(self._slave_fd)
+        self.port_name = os.ttyname(self._slave_fd)
+
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop_event.set()
+        self._thread.join()
+        os.close(self._master_fd)
+        os.close(self._slave_fd)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def _replay(self, command):
+        """
+        Streams one recording, writing every line that is due each sampling period.
+        """
+        timestamps, values = load_recording(self.recordings[command])
+        timestamps = timestamps - timestamps[0]
+        start_time = time.monotonic()
+        line_index = 0
+
+        while line_index < len(timestamps) and not self._stop_event.is_set():
+            elapsed_ms = (time.monotonic() - start_time) * 1000 * self.speed
+            lines = []
+
+            while line_index < len(timestamps) and timestamps[line_index] <= elapsed_ms:
+                line_index += 1
+
+                if self.corrupt_every and line_index % self.corrupt_every == 0:
+                    lines.append(f"{int(timestamps[line_index - 1])},\r\n")
+                else:
+                    lines.append(f"{int(timestamps[line_index - 1])},{int(values[line_index - 1])}\r\n")
+
+            if lines:
+                os.write(self._master_fd, "".join(lines).encode())
+
+            # One tick of the 5 ms sampling period of the firmware
+            time.sleep(0.005)
+
+    def _run(self):
+        pending = b""
+
+        while not self._stop_event.is_set():
+
+            readable, _, _ = select.select([self._master_fd], [], [], 0.05)
+
+            if readable:
+                pending += os.read(self._master_fd, 1024)
+
+            # Commands may arrive with or without a newline, as in Serial_V4.ipynb
+            for command in ("ECG", "PPG"):
+
+                if command.encode() in pending:
+                    pending = b""
+                    self._replay(command)
+                    break
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Replay Data/Test recordings over a pseudo-terminal as the ESP32 would.")
+    parser.add_argument("--ecg", help="ECG recording to replay.")
+    parser.add_argument("--ppg", help="PPG recording to replay.")
+    parser.add_argument("--speed", type=float, default=1.0, help="Replay speed factor (default: real time).")
+    parser.add_argument("--corrupt-every", type=int, default=0, help="Send every n-th line malformed.")
+    arguments = parser.parse_args()
+
+    recordings = {command: path for command, path in (("ECG", arguments.ecg), ("PPG", arguments.ppg)) if path}
+
+    with ESP32Simulator(recordings, arguments.speed, arguments.corrupt_every) as simulator:
+        print(f"ESP32 simulator listening on {simulator.port_name}")
+
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,513 @@
+import os
+import sys
+import csv
+import json
+import time
+import cProfile
+import functools
+import threading
+import tracemalloc
+
+# Stages profiled with cProfile when profiling is enabled without an explicit list
+HOT_STAGES = ("calculate_auto_mutual_information", "knn_dimension_estimation", "correlation_dimension", "largest_lyapunov_exponent", "hurst_exponent")
+
+RECORD_FIELDS = ["file", "stage", "parent", "wall_time", "cpu_time", "peak_memory_bytes", "input_size", "input_shape"]
+
+# Active Recorder; None means instrumentation is disabled
+_recorder = None
+
+class _Frame:
+    """
+    Bookkeeping of one open stage.
+    """
+
+    def __init__(self, stage, input_shape):
+        self.stage = stage
+        self.input_shape = input_shape
+        self.file = None
+        self.memory_start = 0
+        self.memory_peak = 0
+        self.profiler = None
+        self.wall_start = time.perf_counter()
+        self.cpu_start = time.process_time()
+
+class Recorder:
+    """
+    Collects one record per executed stage: wall time, CPU time of the process,
+    peak traced memory and the size of the input. Records are kept in memory for the
+    summary and, if output_path is given, appended to a JSON-lines file (or a CSV file
+    if the path ends in '.csv') as they complete.
+
+    Peak memory comes from tracemalloc, which keeps a single peak for the whole
+    process, and CPU time is that of the whole process. Both are exact for stages
+    nested on one thread, but stages running concurrently on several threads reset
+    and share the same peak, so their peak memory and CPU time are only indicative.
+    Worker threads adopt the stages of the thread that started them (see
+    current_stages and adopt_stages), so their records keep the right parent.
+
+    The recording the records are tagged with is also kept per thread, so recording
+    contexts on several threads do not clobber each other. Stages opened outside any
+    recording context on a thread take the recording of their parent stage.
+    """
+
+    def __init__(self, output_path=None, track_memory=True, profile_directory=None, profile_stages=HOT_STAGES):
+        """
+        :param output_path: Optional; .jsonl or .csv file the records are appended to.
+        :param track_memory: If True, peak memory is measured with tracemalloc, which
+                             slows the instrumented code down noticeably.
+        :param profile_directory: Optional; directory for cProfile dumps of the stages in
+                                  profile_stages, one '<file>.<stage>.prof' per run.
+        :param profile_stages: Names of the stages to profile.
+        """
+        self.output_path = output_path
+        self.track_memory = track_memory
+        self.profile_directory = profile_directory
+        self.profile_stages = set(profile_stages)
+        self.records = []
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._profiling = False
+        self._output_file = None
+        self._csv_writer = None
+
+        if output_path is not None:
+            self._output_file = open(output_path, "a", newline="")
+
+            if output_path.endswith(".csv"):
+                self._csv_writer = csv.DictWriter(self._output_file, fieldnames=RECORD_FIELDS)
+
+                if self._output_file.tell() == 0:
+                    self._csv_writer.writeheader()
+
+        if profile_directory is not None:
+            os.makedirs(profile_directory, exist_ok=True)
+
+        # Leave tracemalloc running afterwards if someone else started it
+        self._started_tracing = track_memory and not tracemalloc.is_tracing()
+
+        if self._started_tracing:
+            tracemalloc.start()
+
+    def _stack(self):
+        # Each thread nests its own stages, e.g. the FNN dimensions run on a thread pool
+        if not hasattr(self._local, "stack"):
+            self._local.stack = []
+
+        return self._local.stack
+
+    @property
+    def file(self):
+        """
+        Path of the recording set on the calling thread, or None.
+        """
+        return getattr(self._local, "file", None)
+
+    @file.setter
+    def file(self, file_path):
+        self._local.file = file_path
+
+    def enter(self, stage, input_shape=None):
+        """
+        Opens a stage on the calling thread.
+
+        :param stage: Name of the stage.
+        :param input_shape: Optional; shape of the stage input.
+        """
+        stack = self._stack()
+        frame = _Frame(stage, input_shape)
+
+        # Adopted worker stages have no recording of their own and inherit the parent's
+        frame.file = self.file if self.file is not None or not stack else stack[-1].file
+
+        # The parent keeps the peak reached so far; the child measures from here
+        if self.track_memory:
+            current, peak = tracemalloc.get_traced_memory()
+
+            if stack:
+                stack[-1].memory_peak = max(stack[-1].memory_peak, peak)
+
+            tracemalloc.reset_peak()
+            frame.memory_start = current
+            frame.memory_peak = current
+
+        # Only one profiler can be active at a time, so nested hot stages are part of the outer profile
+        if self.profile_directory is not None and stage in self.profile_stages:
+
+            with self._lock:
+
+                if not self._profiling:
+                    self._profiling = True
+                    frame.profiler = cProfile.Profile()
+
+            if frame.profiler is not None:
+                frame.profiler.enable()
+
+        stack.append(frame)
+
+    def exit(self):
+        """
+        Closes the innermost stage of the calling thread and stores its record.
+
+        :return: The record of the stage.
+        """
+        stack = self._stack()
+        frame = stack.pop()
+        wall_time = time.perf_counter() - frame.wall_start
+        cpu_time = time.process_time() - frame.cpu_start
+
+        if frame.profiler is not None:
+            frame.profiler.disable()
+            file_name = os.path.basename(frame.file).split('.')[0] if frame.file else "session"
+            frame.profiler.dump_stats(os.path.join(self.profile_directory, f"{file_name}.{frame.stage}.prof"))
+
+            with self._lock:
+                self._profiling = False
+
+        peak_memory = None
+
+        if self.track_memory:
+            _, peak = tracemalloc.get_traced_memory()
+            frame.memory_peak = max(frame.memory_peak, peak)
+            peak_memory = frame.memory_peak - frame.memory_start
+
+            # Hand the peak on to the parent, which measures from its own start
+            if stack:
+                stack[-1].memory_peak = max(stack[-1].memory_peak, frame.memory_peak)
+
+            tracemalloc.reset_peak()
+
+        input_shape = list(frame.input_shape) if frame.input_shape is not None else None
+        input_size = None
+
+        if input_shape is not None:
+            input_size = 1
+
+            for length in input_shape:
+                input_size *= length
+
+        record = {
+            "file": frame.file,
+            "stage": frame.stage,
+            "parent": stack[-1].stage if stack else None,
+            "wall_time": wall_time,
+            "cpu_time": cpu_time,
+            "peak_memory_bytes": peak_memory,
+            "input_size": input_size,
+            "input_shape": input_shape,
+        }
+        self.write(record)
+
+        return record
+
+    def write(self, record):
+        """
+        Stores a record and appends it to the output file.
+
+        :param record: Dictionary with the RECORD_FIELDS.
+        """
+        with self._lock:
+            self.records.append(record)
+
+            if self._csv_writer is not None:
+                self._csv_writer.writerow(record)
+                self._output_file.flush()
+            elif self._output_file is not None:
+                self._output_file.write(json.dumps(record) + "\n")
+                self._output_file.flush()
+
+    def close(self):
+        """
+        Closes the output file and stops tracemalloc if the recorder started it.
+        """
+        if self._output_file is not None:
+            self._output_file.close()
+            self._output_file = None
+
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+
+class _Stage:
+    """
+    Context manager that records one stage with the active Recorder.
+    """
+
+    def __init__(self, recorder, name, input_shape):
+        self.recorder = recorder
+        self.name = name
+        self.input_shape = input_shape
+
+    def __enter__(self):
+        self.recorder.enter(self.name, self.input_shape)
+        return self
+
+    def __exit__(self, *exc_info):
+        self.record = self.recorder.exit()
+        return False
+
+class _NullStage:
+    """
+    Context manager that does nothing, used while instrumentation is disabled.
+    """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+_NULL_STAGE = _NullStage()
+
+def shape_of(value):
+    """
+    Describes the size of a stage input.
+
+    :param value: Array, sequence or any other object.
+    :return: Tuple with the shape of an array, the length of a sequence, or None for
+             text and objects without a length.
+    """
+    # A path or other text is not a stage input worth sizing
+    if isinstance(value, (str, bytes)):
+        return None
+
+    shape = getattr(value, "shape", None)
+
+    if shape is not None:
+        return tuple(int(length) for length in shape)
+
+    try:
+        return (len(value),)
+    except TypeError:
+        return None
+
+def stage(name, data=None):
+    """
+    Context manager that records a block of code as a stage.
+
+    :param name: Name of the stage.
+    :param data: Optional; input of the stage, used to record its size.
+    :return: Context manager.
+    """
+    if _recorder is None:
+        return _NULL_STAGE
+
+    return _Stage(_recorder, name, shape_of(data) if data is not None else None)
+
+class _Adopted:
+    """
+    Context manager that nests the stages of a worker thread under stages opened on
+    another thread.
+    """
+
+    def __init__(self, recorder, frames):
+        self.recorder = recorder
+        self.frames = frames
+
+    def __enter__(self):
+        stack = self.recorder._stack()
+        self.previous_frames = stack[:]
+        stack[:] = self.frames
+        return self
+
+    def __exit__(self, *exc_info):
+        self.recorder._stack()[:] = self.previous_frames
+        return False
+
+def current_stages():
+    """
+    Captures the stages open on the calling thread, to be handed to worker threads.
+
+    :return: Opaque list of open stages, or None while instrumentation is disabled.
+    """
+    if _recorder is None:
+        return None
+
+    return list(_recorder._stack())
+
+def adopt_stages(stages):
+    """
+    Context manager that makes the stages captured with current_stages the parents of
+    the stages opened inside it on the calling thread.
+
+    :param stages: Value returned by current_stages.
+    :return: Context manager.
+    """
+    if _recorder is None or stages is None:
+        return _NULL_STAGE
+
+    return _Adopted(_recorder, stages)
+
+def instrumented(function):
+    """
+    Decorator that records every call of a function as a stage named after it. The
+    size of the first argument is recorded as the input size. While instrumentation
+    is disabled the only cost is one global lookup per call.
+
+    :param function: Function to instrument.
+    :return: Wrapped function.
+    """
+    name = function.__name__
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+
+        if _recorder is None:
+            return function(*args, **kwargs)
+
+        with _Stage(_recorder, name, shape_of(args[0]) if args else None):
+            return function(*args, **kwargs)
+
+    return wrapper
+
+class _File:
+    """
+    Context manager that attributes the records of a block on the calling thread to a
+    recording.
+    """
+
+    def __init__(self, recorder, file_path):
+        self.recorder = recorder
+        self.file_path = file_path
+
+    def __enter__(self):
+        self.previous_file = self.recorder.file
+        self.recorder.file = self.file_path
+        return self
+
+    def __exit__(self, *exc_info):
+        self.recorder.file = self.previous_file
+        return False
+
+def recording(file_path):
+    """
+    Context manager that tags the records made inside it with a recording path.
+
+    :param file_path: Path to the recording being analyzed.
+    :return: Context manager.
+    """
+    if _recorder is None:
+        return _NULL_STAGE
+
+    return _File(_recorder, file_path)
+
+def enable(output_path=None, track_memory=True, profile_directory=None, profile_stages=HOT_STAGES):
+    """
+    Turns instrumentation on for the current process. See Recorder for the parameters.
+
+    :return: The active Recorder.
+    """
+    global _recorder
+
+    disable()
+    _recorder = Recorder(output_path, track_memory, profile_directory, profile_stages)
+
+    return _recorder
+
+def active_recorder():
+    """
+    :return: The active Recorder, or None if instrumentation is disabled.
+    """
+    return _recorder
+
+def disable():
+    """
+    Turns instrumentation off and closes the active Recorder.
+
+    :return: The Recorder that was active, or None.
+    """
+    global _recorder
+
+    recorder = _recorder
+    _recorder = None
+
+    if recorder is not None:
+        recorder.close()
+
+    return recorder
+
+def read_records(path):
+    """
+    Reads the records written by a Recorder.
+
+    :param path: .jsonl or .csv file, or a directory whose .jsonl and .csv files are read.
+    :return: List of records.
+    """
+    if os.path.isdir(path):
+        records = []
+
+        for file_name in sorted(os.listdir(path)):
+
+            if file_name.endswith((".jsonl", ".csv")):
+                records.extend(read_records(os.path.join(path, file_name)))
+
+        return records
+
+    with open(path, "r", newline="") as records_file:
+
+        if path.endswith(".csv"):
+            records = list(csv.DictReader(records_file))
+
+            # CSV stores every field as text
+            for record in records:
+
+                for field in ("wall_time", "cpu_time"):
+                    record[field] = float(record[field])
+
+                for field in ("peak_memory_bytes", "input_size"):
+                    record[field] = int(record[field]) if record[field] else None
+
+            return records
+
+        return [json.loads(line) for line in records_file if line.strip()]
+
+def summarize(records):
+    """
+    Aggregates the records per stage.
+
+    :param records: List of records.
+    :return: List of dictionaries with the stage name, number of calls, total and mean
+             wall time, total CPU time, largest peak memory and largest input size,
+             slowest stage first.
+    """
+    stages = {}
+
+    for record in records:
+        summary = stages.setdefault(record["stage"], {"stage": record["stage"], "calls": 0, "wall_time": 0.0, "cpu_time": 0.0, "peak_memory_bytes": None, "input_size": None})
+        summary["calls"] += 1
+        summary["wall_time"] += record["wall_time"]
+        summary["cpu_time"] += record["cpu_time"]
+
+        for field in ("peak_memory_bytes", "input_size"):
+
+            if record[field] is not None:
+                summary[field] = max(summary[field] or 0, record[field])
+
+    for summary in stages.values():
+        summary["mean_wall_time"] = summary["wall_time"] / summary["calls"]
+
+    return sorted(stages.values(), key=lambda summary: summary["wall_time"], reverse=True)
+
+def format_summary(records):
+    """
+    Formats the per-stage summary of a set of records as a text table.
+
+    :param records: List of records.
+    :return: String with one line per stage.
+    """
+    lines = [f"{'stage':<36} {'calls':>6} {'wall (s)':>10} {'mean (s)':>10} {'cpu (s)':>10} {'peak (MB)':>10} {'input':>10}"]
+
+    for summary in summarize(records):
+        peak = f"{summary['peak_memory_bytes'] / 2 ** 20:10.1f}" if summary["peak_memory_bytes"] is not None else f"{'-':>10}"
+        input_size = f"{summary['input_size']:10d}" if summary["input_size"] is not None else f"{'-':>10}"
+        lines.append(f"{summary['stage']:<36} {summary['calls']:6d} {summary['wall_time']:10.3f} {summary['mean_wall_time']:10.4f} {summary['cpu_time']:10.3f} {peak} {input_size}")
+
+    return "\n".join(lines)
+
+if __name__ == "__main__":
+
+    # Summary report of the records written by earlier runs
+    if len(sys.argv) != 2:
+        print("Usage: python instrumentation.py RECORDS (.jsonl, .csv or a directory of them)")
+        sys.exit(2)
+
+    print(format_summary(read_records(sys.argv[1])))
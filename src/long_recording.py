@@ -0,0 +1,482 @@
+import os
+import sys
+import json
+import argparse
+import numpy as np
+
+from atractor_v10 import (FALSE_NEIGHBORS_THRESHOLD, digitize_time_series, false_neighbor_flags, find_prime_index, fit_line,
+                          load_recording, logarithmic_radii, mutual_information_from_joint_counts, parse_recording_text,
+                          phase_space_reconstruction, recording_cache_is_current, recording_cache_paths, recording_signature)
+import instrumentation
+from instrumentation import instrumented
+
+DEFAULT_MEMORY_BUDGET = 1024 * 1024 * 1024
+
+# Bytes held per sample of a chunk: the float64 samples, their partition indices and pair codes
+CHUNK_BYTES_PER_SAMPLE = 48
+
+# Leaf size of the KD-trees; the NearestNeighbors default, so ties between equally
+# distant neighbors resolve as in nearest_neighbor_query
+KD_TREE_LEAF_SIZE = 30
+
+# Bytes held per byte of text parsed at once: the text, its tokens and the parsed arrays
+PARSE_BYTES_PER_TEXT_BYTE = 40
+
+@instrumented
+def convert_recording_in_chunks(file_path, memory_budget):
+    """
+    Builds the binary cache of a recording (see recording_cache_paths) by parsing the
+    text a block of lines at a time. The timestamps and values of each block are
+    appended to temporary raw files and copied into the cache array at the end, so
+    the conversion stays within memory_budget however long the recording is.
+
+    :param file_path: Path to the recording.
+    :param memory_budget: Memory budget in bytes.
+    :raises ValueError: If the file holds no samples or a line is not 'timestamp : value'.
+    """
+    cache_path, metadata_path = recording_cache_paths(file_path)
+    source_signature = recording_signature(file_path)
+    block_bytes = max(memory_budget // PARSE_BYTES_PER_TEXT_BYTE, 64 * 1024)
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+
+    # Temporary files private to this process, as in load_recording
+    temporary_paths = [f"{cache_path}.{os.getpid()}.{name}.tmp" for name in ("timestamps", "values", "array")]
+    timestamps_path, values_path, array_path = temporary_paths
+    number_of_samples = 0
+
+    try:
+        with open(file_path, "r") as file, open(timestamps_path, "wb") as timestamps_file, open(values_path, "wb") as values_file:
+
+            # readlines stops after block_bytes of whole lines
+            for lines in iter(lambda: file.readlines(block_bytes), []):
+                text = "".join(lines)
+
+                if not text.strip():
+                    continue
+
+                timestamps, values = parse_recording_text(text, file_path)
+                timestamps.tofile(timestamps_file)
+                values.tofile(values_file)
+                number_of_samples += len(values)
+
+        if number_of_samples == 0:
+            raise ValueError(f"{file_path} holds no 'timestamp : value' samples")
+
+        # Copy the raw columns into the (2, N) cache array one block at a time
+        block_length = max(block_bytes // 8, 1)
+        recording = np.lib.format.open_memmap(array_path, mode="w+", dtype=np.float64, shape=(2, number_of_samples))
+
+        for row, raw_path in enumerate((timestamps_path, values_path)):
+            raw_values = np.memmap(raw_path, dtype=np.float64, mode="r", shape=(number_of_samples,))
+
+            for start in range(0, number_of_samples, block_length):
+                recording[row, start:start + block_length] = raw_values[start:start + block_length]
+
+            del raw_values
+
+        recording.flush()
+        del recording
+        os.replace(array_path, cache_path)
+
+        # The metadata goes last, so a half-written cache is never taken as current
+        with open(f"{metadata_path}.{os.getpid()}.tmp", "w") as metadata_file:
+            json.dump(source_signature, metadata_file)
+        os.replace(f"{metadata_path}.{os.getpid()}.tmp", metadata_path)
+
+    finally:
+
+        for temporary_path in temporary_paths:
+
+            if os.path.exists(temporary_path):
+                os.remove(temporary_path)
+
+def open_long_recording(file_path, memory_budget=None):
+    """
+    Memory-maps the values of a recording from its binary cache (see load_recording),
+    so the series is paged in from disk as it is read instead of being held in memory.
+    If the cache is missing or stale, it is first built from the text file with
+    convert_recording_in_chunks, within memory_budget.
+
+    :param file_path: Path to the recording.
+    :param memory_budget: Optional; memory budget in bytes of the conversion. Defaults to
+                          DEFAULT_MEMORY_BUDGET.
+    :return: Read-only memory-mapped array of values.
+    """
+    if not recording_cache_is_current(file_path):
+        convert_recording_in_chunks(file_path, memory_budget if memory_budget is not None else DEFAULT_MEMORY_BUDGET)
+
+    timestamps, values = load_recording(file_path, mmap_mode="r")
+
+    return values
+
+def chunk_length_for_budget(number_of_samples, memory_budget, minimum_length=1):
+    """
+    Chooses the number of samples processed per chunk within a memory budget.
+
+    :param number_of_samples: Length of the series.
+    :param memory_budget: Memory budget in bytes.
+    :param minimum_length: Smallest usable chunk, e.g. the maximum delay plus one.
+    :return: Chunk length.
+    """
+    return int(min(max(memory_budget // CHUNK_BYTES_PER_SAMPLE, minimum_length), number_of_samples))
+
+@instrumented
+def chunked_statistics(time_series_data, chunk_length):
+    """
+    Computes the minimum, maximum, mean and standard deviations of a series one chunk
+    at a time, merging the chunk moments with the parallel variance formula.
+
+    :param time_series_data: The time series data, e.g. a memory-mapped array.
+    :param chunk_length: Number of samples read per chunk.
+    :return: Dictionary with 'minimum', 'maximum', 'mean', 'std' (population) and
+             'sample_std' (one degree of freedom).
+    """
+    count = 0
+    mean = 0.0
+    squared_deviations = 0.0
+    minimum = np.inf
+    maximum = -np.inf
+
+    for start in range(0, len(time_series_data), chunk_length):
+        chunk = np.asarray(time_series_data[start:start + chunk_length], dtype=np.float64)
+        chunk_mean = np.mean(chunk)
+
+        # Merge the moments of the chunk into the running ones
+        delta = chunk_mean - mean
+        total = count + len(chunk)
+        mean += delta * len(chunk) / total
+        squared_deviations += np.sum((chunk - chunk_mean) ** 2) + delta ** 2 * count * len(chunk) / total
+        count = total
+
+        minimum = min(minimum, np.min(chunk))
+        maximum = max(maximum, np.max(chunk))
+
+    return {
+        "minimum": minimum,
+        "maximum": maximum,
+        "mean": mean,
+        "std": np.sqrt(squared_deviations / count),
+        "sample_std": np.sqrt(squared_deviations / (count - 1)) if count > 1 else np.nan,
+    }
+
+@instrumented
+def chunked_auto_mutual_information(time_series_data, maximum_delay, number_of_partitions, chunk_length, statistics=None):
+    """
+    Calculates the auto mutual information of a series one chunk at a time. Each chunk
+    is normalized and binned, and the joint histograms of the pairs starting in it are
+    added to running counts, so only one chunk plus maximum_delay samples is in memory.
+    Returns the same values and delay as calculate_auto_mutual_information.
+
+    :param time_series_data: The time series data, e.g. a memory-mapped array.
+    :param maximum_delay: The maximum delay to consider.
+    :param number_of_partitions: The number of partitions.
+    :param chunk_length: Number of samples binned per chunk.
+    :param statistics: Optional; result of chunked_statistics, computed if None.
+    :return: A tuple containing the list of mutual information values and the optimal delay.
+    """
+    number_of_samples = len(time_series_data)
+    bins_per_axis = number_of_partitions + 1
+
+    if statistics is None:
+        statistics = chunked_statistics(time_series_data, chunk_length)
+
+    minimum = statistics["minimum"]
+    maximum = statistics["maximum"]
+    joint_counts = np.zeros((maximum_delay, bins_per_axis, bins_per_axis), dtype=np.int64)
+
+    for start in range(0, number_of_samples, chunk_length):
+        stop = min(start + chunk_length, number_of_samples)
+
+        # The chunk carries maximum_delay extra samples for the delayed partners
+        block = np.asarray(time_series_data[start:min(stop + maximum_delay, number_of_samples)], dtype=np.float64)
+        partition_indices = digitize_time_series((block - minimum) / (maximum - minimum), number_of_partitions)
+
+        for tau in range(1, maximum_delay + 1):
+            number_of_pairs = min(stop, number_of_samples - tau) - start
+
+            if number_of_pairs <= 0:
+                continue
+
+            pair_codes = partition_indices[:number_of_pairs] * bins_per_axis + partition_indices[tau:tau + number_of_pairs]
+            joint_counts[tau - 1] += np.bincount(pair_codes, minlength=bins_per_axis * bins_per_axis).reshape(bins_per_axis, bins_per_axis)
+
+    tau_values = np.arange(1, maximum_delay + 1)
+    mutual_information_values = list(mutual_information_from_joint_counts(joint_counts, number_of_partitions, number_of_samples - tau_values))
+
+    # Same selection as calculate_pim
+    optimal_delay = find_prime_index(mutual_information_values, number_of_samples)
+
+    return mutual_information_values, optimal_delay if optimal_delay != 0 else maximum_delay
+
+def select_reference_points(number_of_points, number_of_reference_points, random_generator):
+    """
+    Draws reference points without replacement.
+
+    :param number_of_points: Number of points to draw from.
+    :param number_of_reference_points: Number of points to draw; every point is used if
+                                       this is not smaller than number_of_points.
+    :param random_generator: numpy Generator.
+    :return: Sorted array of point indices.
+    """
+    if number_of_reference_points >= number_of_points:
+        return np.arange(number_of_points)
+
+    return np.sort(random_generator.choice(number_of_points, number_of_reference_points, replace=False))
+
+def sampling_standard_error(fraction, number_of_reference_points, number_of_points):
+    """
+    Binomial standard error of a fraction estimated from reference points drawn without
+    replacement, including the finite population correction.
+
+    :param fraction: Estimated fraction.
+    :param number_of_reference_points: Number of reference points.
+    :param number_of_points: Number of points they were drawn from.
+    :return: Standard error; 0 when every point was used.
+    """
+    if number_of_reference_points >= number_of_points:
+        return 0.0
+
+    finite_population_correction = (number_of_points - number_of_reference_points) / (number_of_points - 1)
+
+    return float(np.sqrt(fraction * (1 - fraction) / number_of_reference_points * finite_population_correction))
+
+def embedding_index_bytes(number_of_points, embedding_dimension):
+    """
+    Estimates the memory used by a full reconstruction and its KD-tree.
+
+    :param number_of_points: Number of reconstructed points.
+    :param embedding_dimension: The embedding dimension.
+    :return: Number of bytes.
+    """
+    number_of_nodes = 2 * max(number_of_points // KD_TREE_LEAF_SIZE, 1)
+
+    # Points, index array, and the bounds and metadata of every node
+    return number_of_points * (embedding_dimension + 1) * 8 + number_of_nodes * (2 * embedding_dimension * 8 + 32)
+
+@instrumented
+def build_embedding_index(time_series_data, embedding_dimension, delay, memory_budget):
+    """
+    Reconstructs the full phase space and builds its KD-tree. The reconstruction is
+    copied once, since the tree needs contiguous points, and the copy becomes the data of
+    the tree; its size and that of the tree nodes are checked against memory_budget
+    (see embedding_index_bytes) before anything is allocated.
+
+    :param time_series_data: The time series data.
+    :param embedding_dimension: The embedding dimension for the reconstruction.
+    :param delay: The delay to be used in the reconstruction.
+    :param memory_budget: Memory budget in bytes.
+    :return: Tuple containing the KD-tree and the reconstructed points.
+    """
+    from sklearn.neighbors import KDTree
+
+    number_of_points = len(time_series_data) - (embedding_dimension - 1) * delay
+    required_bytes = embedding_index_bytes(number_of_points, embedding_dimension)
+
+    if required_bytes > memory_budget:
+        raise MemoryError(f"The neighbor index of {number_of_points} points in dimension {embedding_dimension} needs about {required_bytes / 2 ** 20:.0f} MB, over the memory budget of {memory_budget / 2 ** 20:.0f} MB.")
+
+    reconstructed_data = phase_space_reconstruction(time_series_data, embedding_dimension, delay)
+
+    return KDTree(reconstructed_data, leaf_size=KD_TREE_LEAF_SIZE), reconstructed_data
+
+@instrumented
+def subsampled_false_nearest_neighbors(time_series_data, delay, embedding_dimension, relative_tolerance, absolute_tolerance, standard_deviation_of_data,
+                                       number_of_reference_points, random_generator, memory_budget):
+    """
+    Estimates the fraction of false nearest neighbors of one embedding dimension from a
+    random subsample of reference points. The neighbors of the reference points are
+    searched among all points of the reconstruction. With as many reference points as
+    reconstructed points the result equals calculate_false_nearest_neighbors.
+
+    :param time_series_data: The time series data.
+    :param delay: The delay to use in the phase space reconstruction.
+    :param embedding_dimension: The embedding dimension to evaluate.
+    :param relative_tolerance: The relative tolerance for nearest neighbor search.
+    :param absolute_tolerance: The absolute tolerance for nearest neighbor search.
+    :param standard_deviation_of_data: Standard deviation of the series.
+    :param number_of_reference_points: Number of reference points.
+    :param random_generator: numpy Generator used to draw the reference points.
+    :param memory_budget: Memory budget in bytes.
+    :return: Tuple containing the estimated fraction and its standard error.
+    """
+    tree, reconstructed_data = build_embedding_index(time_series_data, embedding_dimension, delay, memory_budget)
+    number_of_points = len(reconstructed_data)
+    reference_indices = select_reference_points(number_of_points, number_of_reference_points, random_generator)
+
+    # Column 0 is the reference point itself and column 1 its nearest neighbor
+    distances, indices = tree.query(reconstructed_data[reference_indices], k=2)
+    false_neighbors = false_neighbor_flags(time_series_data, reference_indices, indices[:, 1], distances[:, 1], embedding_dimension, delay,
+                                           relative_tolerance, absolute_tolerance, standard_deviation_of_data)
+
+    fraction = np.count_nonzero(false_neighbors) / len(reference_indices)
+
+    return fraction, sampling_standard_error(fraction, len(reference_indices), number_of_points)
+
+@instrumented
+def subsampled_dimension_estimation(time_series_data, delay, max_embedding_dimension, relative_tolerance, absolute_tolerance, standard_deviation_of_data,
+                                    number_of_reference_points, random_generator, memory_budget):
+    """
+    Estimates the embedding dimension as knn_dimension_estimation does, from the
+    subsampled fractions of false nearest neighbors.
+
+    :param time_series_data: The time series data.
+    :param delay: The delay to use in the phase space reconstruction.
+    :param max_embedding_dimension: The maximum embedding dimension to consider.
+    :param relative_tolerance: The relative tolerance for nearest neighbor search.
+    :param absolute_tolerance: The absolute tolerance for nearest neighbor search.
+    :param standard_deviation_of_data: Standard deviation of the series.
+    :param number_of_reference_points: Number of reference points per dimension.
+    :param random_generator: numpy Generator used to draw the reference points.
+    :param memory_budget: Memory budget in bytes.
+    :return: Tuple containing the FNN array, the array of their standard errors and the
+             estimated embedding dimension.
+    """
+    fnn_values = np.zeros(max_embedding_dimension)
+    fnn_standard_errors = np.zeros(max_embedding_dimension)
+
+    for current_dimension in range(1, max_embedding_dimension + 1):
+        fnn_values[current_dimension - 1], fnn_standard_errors[current_dimension - 1] = subsampled_false_nearest_neighbors(
+            time_series_data, delay, current_dimension, relative_tolerance, absolute_tolerance, standard_deviation_of_data,
+            number_of_reference_points, random_generator, memory_budget)
+
+        if fnn_values[current_dimension - 1] < FALSE_NEIGHBORS_THRESHOLD:
+            return fnn_values, fnn_standard_errors, current_dimension
+
+    return fnn_values, fnn_standard_errors, np.argmin(fnn_values) + 1
+
+@instrumented
+def subsampled_correlation_dimension(time_series_data, embedding_dimension, delay, radius_values, number_of_reference_points, random_generator, memory_budget,
+                                     number_of_groups=10, fit="RANSAC"):
+    """
+    Estimates the correlation sums and dimension of a series from a random subsample of
+    reference points. The pairs between the reference points and all points of the
+    reconstruction are counted in one dual-tree pass per group of reference points. The
+    standard errors come from the spread between the groups. With as many reference
+    points as reconstructed points the sums equal the exact calculate_correlation_sums.
+
+    :param time_series_data: The time series data.
+    :param embedding_dimension: The embedding dimension for the reconstruction.
+    :param delay: The delay to be used in the reconstruction.
+    :param radius_values: Array of radii.
+    :param number_of_reference_points: Number of reference points.
+    :param random_generator: numpy Generator used to draw and group the reference points.
+    :param memory_budget: Memory budget in bytes.
+    :param number_of_groups: Number of groups the reference points are split into.
+    :param fit: 'RANSAC' for a robust fit or 'poly' for least squares.
+    :return: Dictionary with the correlation sums, their standard errors, the correlation
+             dimension and its standard error.
+    """
+    tree, reconstructed_data = build_embedding_index(time_series_data, embedding_dimension, delay, memory_budget)
+    number_of_points = len(reconstructed_data)
+    reference_indices = select_reference_points(number_of_points, number_of_reference_points, random_generator)
+    groups = np.array_split(random_generator.permutation(reference_indices), min(number_of_groups, len(reference_indices)))
+
+    # Pairs within each radius, self-matches included, for every group
+    group_counts = np.array([tree.two_point_correlation(reconstructed_data[group], radius_values, dualtree=True) for group in groups], dtype=np.float64)
+    group_sizes = np.array([len(group) for group in groups], dtype=np.float64)
+
+    correlation_sums = group_counts.sum(axis=0) / (len(reference_indices) * (number_of_points - 1))
+    group_sums = group_counts / (group_sizes[:, np.newaxis] * (number_of_points - 1))
+
+    def slope(sums):
+        nonzero = sums > 0
+        return fit_line(np.log(radius_values[nonzero]), np.log(sums[nonzero]), fit)[0] if np.count_nonzero(nonzero) > 1 else np.nan
+
+    # Spread of the group estimates, scaled to the mean of all groups
+    if len(reference_indices) < number_of_points and len(groups) > 1:
+        finite_population_correction = np.sqrt((number_of_points - len(reference_indices)) / (number_of_points - 1))
+        correlation_sum_standard_errors = np.std(group_sums, axis=0, ddof=1) / np.sqrt(len(groups)) * finite_population_correction
+        group_slopes = np.array([slope(sums) for sums in group_sums])
+        dimension_standard_error = float(np.nanstd(group_slopes, ddof=1) / np.sqrt(np.count_nonzero(np.isfinite(group_slopes))) * finite_population_correction)
+    else:
+        correlation_sum_standard_errors = np.zeros(len(radius_values))
+        dimension_standard_error = 0.0
+
+    return {
+        "correlation_sums": correlation_sums,
+        "correlation_sum_standard_errors": correlation_sum_standard_errors,
+        "correlation_dimension": float(slope(correlation_sums)),
+        "correlation_dimension_standard_error": dimension_standard_error,
+    }
+
+def analyze_long_recording(data_file_path, max_delay_taumax=16, num_partitions=2, max_embedding_dimension=10, relative_tolerance=10, absolute_tolerance=2,
+                           number_of_reference_points=10000, memory_budget=DEFAULT_MEMORY_BUDGET, seed=0):
+    """
+    Runs the delay, embedding dimension and correlation dimension analysis on a
+    recording too long for analyze_recording. The series is memory-mapped, the auto
+    mutual information is accumulated chunk by chunk, and the false nearest neighbors
+    and correlation sums are estimated from reference-point subsamples searched against
+    the full neighbor index of each embedding. Every allocation is sized to stay within
+    memory_budget, and the estimates come with their sampling standard errors.
+
+    :param data_file_path: Path to the recording.
+    :param max_delay_taumax: The maximum delay for the mutual information calculation.
+    :param num_partitions: The number of partitions for the mutual information calculation.
+    :param max_embedding_dimension: The maximum embedding dimension to consider.
+    :param relative_tolerance: The relative tolerance for nearest neighbor search.
+    :param absolute_tolerance: The absolute tolerance for nearest neighbor search.
+    :param number_of_reference_points: Number of reference points per estimate.
+    :param memory_budget: Memory budget in bytes.
+    :param seed: Seed of the reference point draws.
+    :return: Dictionary with the results and their standard errors.
+    """
+    random_generator = np.random.default_rng(seed)
+
+    with instrumentation.recording(data_file_path), instrumentation.stage("analyze_long_recording"):
+        time_series_data = open_long_recording(data_file_path, memory_budget)
+        chunk_length = chunk_length_for_budget(len(time_series_data), memory_budget, max_delay_taumax + 1)
+        statistics = chunked_statistics(time_series_data, chunk_length)
+
+        mutual_info_values, optimal_delay = chunked_auto_mutual_information(time_series_data, max_delay_taumax, num_partitions, chunk_length, statistics)
+
+        fnn_values, fnn_standard_errors, estimated_embedding_dimension = subsampled_dimension_estimation(
+            time_series_data, optimal_delay, max_embedding_dimension, relative_tolerance, absolute_tolerance, statistics["std"],
+            number_of_reference_points, random_generator, memory_budget)
+
+        # Same radii as correlation_dimension
+        radius_values = logarithmic_radii(0.1 * statistics["sample_std"], 0.5 * statistics["sample_std"], 1.03)
+        correlation = subsampled_correlation_dimension(time_series_data, estimated_embedding_dimension, optimal_delay, radius_values,
+                                                       number_of_reference_points, random_generator, memory_budget)
+
+    return {
+        "file": data_file_path,
+        "number_of_samples": len(time_series_data),
+        "number_of_reference_points": number_of_reference_points,
+        "tau": int(optimal_delay),
+        "mutual_information": [float(value) for value in mutual_info_values],
+        "embedding_dimension": int(estimated_embedding_dimension),
+        "fnn_values": fnn_values.tolist(),
+        "fnn_standard_errors": fnn_standard_errors.tolist(),
+        "radius_values": radius_values.tolist(),
+        "correlation_sums": correlation["correlation_sums"].tolist(),
+        "correlation_sum_standard_errors": correlation["correlation_sum_standard_errors"].tolist(),
+        "correlation_dimension": correlation["correlation_dimension"],
+        "correlation_dimension_standard_error": correlation["correlation_dimension_standard_error"],
+    }
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Analyze a recording too long for atractor_v10.py within a memory budget.")
+    parser.add_argument("recording", help="Recording in the 'timestamp : value' format.")
+    parser.add_argument("--memory-budget", type=float, default=1024, help="Memory budget in MB (default: 1024).")
+    parser.add_argument("--reference-points", type=int, default=10000, help="Reference points per FNN and correlation sum estimate (default: 10000).")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the reference point draws.")
+    parser.add_argument("--taumax", type=int, default=16, help="Maximum delay for the auto mutual information.")
+    parser.add_argument("--partitions", type=int, default=2, help="Number of partitions for the auto mutual information.")
+    parser.add_argument("--max-dimension", type=int, default=10, help="Maximum embedding dimension for FNN.")
+    parser.add_argument("--rtol", type=float, default=10, help="Relative tolerance for FNN.")
+    parser.add_argument("--atol", type=float, default=2, help="Absolute tolerance for FNN.")
+    arguments = parser.parse_args()
+
+    try:
+        results = analyze_long_recording(arguments.recording, arguments.taumax, arguments.partitions, arguments.max_dimension, arguments.rtol, arguments.atol,
+                                         arguments.reference_points, int(arguments.memory_budget * 1024 * 1024), arguments.seed)
+    except MemoryError as error:
+        print(error, file=sys.stderr)
+        sys.exit(1)
+
+    dimension = results["embedding_dimension"]
+    print(f"Samples: {results['number_of_samples']} --- Reference points: {results['number_of_reference_points']}")
+    print(f"Optimal Delay T: {results['tau']}")
+    print(f"Estimated Embedding Dimension D: {dimension} (FNN {results['fnn_values'][dimension - 1]:.4f} +/- {results['fnn_standard_errors'][dimension - 1]:.4f})")
+    print(f"Correlation Dimension: {results['correlation_dimension']:.4f} +/- {results['correlation_dimension_standard_error']:.4f}")
@@ -0,0 +1,215 @@
+import os
+import json
+import pickle
+import hashlib
+import numpy as np
+
+def fingerprint_samples(time_series_data):
+    """
+    Hashes the samples of a time series, independently of how they were loaded.
+
+    :param time_series_data: The time series data.
+    :return: Hexadecimal SHA-256 digest of the samples as float64.
+    """
+    samples = np.ascontiguousarray(time_series_data, dtype=np.float64)
+
+    return hashlib.sha256(samples.tobytes()).hexdigest()
+
+def normalize_parameters(value):
+    """
+    Brings stage parameters to one canonical form for hashing, so equal numbers give the
+    same key whatever their type: 20, 20.0 and numpy.int64(20) all become 20.0.
+
+    :param value: Parameter value, or a dictionary, list or array of them.
+    :return: The value with every number as a float and every container as a dict or list.
+    """
+    if isinstance(value, dict):
+        return {str(key): normalize_parameters(item) for key, item in value.items()}
+
+    if isinstance(value, np.ndarray):
+        value = value.tolist()
+
+    if isinstance(value, (list, tuple)):
+        return [normalize_parameters(item) for item in value]
+
+    # Booleans are integers to Python, but stay distinct from 0 and 1
+    if isinstance(value, (bool, np.bool_)):
+        return bool(value)
+
+    if isinstance(value, (int, float, np.integer, np.floating)):
+        return float(value)
+
+    return value
+
+# Fraction of max_bytes an eviction trims the store down to, so a full store is not walked on every write
+EVICTION_TARGET = 0.9
+
+class StageCache:
+    """
+    On-disk, content-addressed store for the results of the analysis stages. A result
+    is keyed by the stage name, the fingerprint of the input samples and the stage
+    parameters. Downstream stages take the outputs of upstream stages (e.g. the optimal
+    delay) as parameters, so a parameter change only invalidates the stages it affects.
+
+    Entries are pickle files. The modification time of an entry is refreshed on every
+    hit, and the least recently used entries are evicted when the store grows past
+    max_bytes. The store size is scanned once when the cache is opened and then kept
+    as a running total of the entries this process writes, so the directory is only
+    walked again when the total passes max_bytes. Entries written meanwhile by other
+    processes are counted at that walk.
+    """
+
+    def __init__(self, directory, max_bytes=512 * 1024 * 1024):
+        """
+        :param directory: Directory holding the cache entries.
+        :param max_bytes: Size cap of the store in bytes.
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.stored_bytes = 0
+        os.makedirs(directory, exist_ok=True)
+
+        # Measure the existing store, trimming it if it is already over the cap
+        self.evict()
+
+    def key(self, stage, samples_fingerprint, parameters):
+        """
+        Builds the key of a stage result.
+
+        :param stage: Name of the stage, e.g. 'ami'.
+        :param samples_fingerprint: Fingerprint of the input samples.
+        :param parameters: Dictionary with the stage parameters.
+        :return: Hexadecimal key.
+        """
+        description = json.dumps({"stage": stage, "samples": samples_fingerprint, "parameters": normalize_parameters(parameters)}, sort_keys=True, default=float)
+
+        return hashlib.sha256(description.encode()).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], f"{key}.pkl")
+
+    def get(self, key):
+        """
+        Looks up a stage result.
+
+        :param key: Key returned by StageCache.key.
+        :return: Tuple containing a hit flag and the cached value (None on a miss).
+        """
+        path = self._path(key)
+
+        try:
+            with open(path, "rb") as entry_file:
+                value = pickle.load(entry_file)
+        except FileNotFoundError:
+            self.misses += 1
+            return False, None
+        except Exception:
+
+            # A truncated or stale entry can fail to unpickle in many ways; drop it and recompute
+            try:
+                entry_size = os.path.getsize(path)
+                os.remove(path)
+                self.stored_bytes = max(self.stored_bytes - entry_size, 0)
+            except OSError:
+                pass
+
+            self.misses += 1
+            return False, None
+
+        # Mark the entry as recently used
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+
+        self.hits += 1
+
+        return True, value
+
+    def put(self, key, value):
+        """
+        Stores a stage result and evicts old entries if the running store size passes
+        its cap.
+
+        :param key: Key returned by StageCache.key.
+        :param value: Picklable stage result.
+        """
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        # Write through a private temporary file so concurrent readers never see partial entries
+        temporary_path = f"{path}.{os.getpid()}.tmp"
+
+        with open(temporary_path, "wb") as entry_file:
+            pickle.dump(value, entry_file, protocol=pickle.HIGHEST_PROTOCOL)
+            entry_size = entry_file.tell()
+
+        # A rewritten entry replaces the bytes of the previous one
+        try:
+            entry_size -= os.path.getsize(path)
+        except OSError:
+            pass
+
+        os.replace(temporary_path, path)
+        self.stored_bytes += entry_size
+
+        if self.stored_bytes > self.max_bytes:
+            self.evict()
+
+    def evict(self):
+        """
+        Deletes the least recently used entries, if the store is over max_bytes, until
+        it fits in EVICTION_TARGET of max_bytes, and resets the running store size to
+        the size measured on disk.
+        """
+        entries = []
+
+        for root, dirs, files in os.walk(self.directory):
+
+            for file_name in files:
+
+                if file_name.endswith(".pkl"):
+                    try:
+                        status = os.stat(os.path.join(root, file_name))
+                    except OSError:
+                        continue
+
+                    entries.append((status.st_mtime_ns, status.st_size, os.path.join(root, file_name)))
+
+        total_bytes = sum(size for _, size, _ in entries)
+        target_bytes = self.max_bytes * EVICTION_TARGET if total_bytes > self.max_bytes else self.max_bytes
+
+        for _, size, path in sorted(entries):
+
+            if total_bytes <= target_bytes:
+                break
+
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+            total_bytes -= size
+
+        self.stored_bytes = total_bytes
+
+    def run(self, stage, samples_fingerprint, parameters, compute):
+        """
+        Returns the cached result of a stage, computing and storing it on a miss.
+
+        :param stage: Name of the stage.
+        :param samples_fingerprint: Fingerprint of the input samples.
+        :param parameters: Dictionary with the stage parameters.
+        :param compute: Function without arguments that computes the stage result.
+        :return: The stage result.
+        """
+        key = self.key(stage, samples_fingerprint, parameters)
+        hit, value = self.get(key)
+
+        if not hit:
+            value = compute()
+            self.put(key, value)
+
+        return value
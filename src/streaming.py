@@ -0,0 +1,283 @@
+import argparse
+import numpy as np
+
+from atractor_v10 import digitize_time_series, find_prime_index, knn_dimension_estimation, load_recording, mutual_information_from_joint_counts
+
+class StreamingAnalyzer:
+    """
+    Sliding-window analyzer for a continuous sample stream. Samples are pushed in chunks
+    of any size. The joint partition histograms behind the auto mutual information are
+    updated incrementally: the pairs of evicted samples are subtracted and the pairs of
+    new samples added. The cost of each update therefore depends on the chunk size and
+    the maximum delay, not on the length of the recording.
+
+    Every hop_length samples, once the window is full, the analyzer emits the mutual
+    information, the optimal delay and (optionally) the FNN embedding dimension of the
+    current window.
+
+    Partitions are normalized to a fixed value range. Without value_range, the range is
+    the minimum and maximum of the first full window, so the first result equals
+    calculate_auto_mutual_information on that window. When a sample falls outside the
+    range, the range is widened to cover the current window and the histograms are rebuilt
+    from the window alone.
+    """
+
+    def __init__(self, window_length, hop_length, maximum_delay=16, number_of_partitions=2, value_range=None, max_embedding_dimension=10, relative_tolerance=10, absolute_tolerance=2, estimate_dimension=True, callback=None):
+        """
+        :param window_length: Number of samples in the analysis window.
+        :param hop_length: Number of new samples between two results.
+        :param maximum_delay: The maximum delay for the mutual information calculation.
+        :param number_of_partitions: The number of partitions for the mutual information calculation.
+        :param value_range: Optional; (low, high) tuple used to normalize the samples.
+        :param max_embedding_dimension: The maximum embedding dimension to consider.
+        :param relative_tolerance: The relative tolerance for nearest neighbor search.
+        :param absolute_tolerance: The absolute tolerance for nearest neighbor search.
+        :param estimate_dimension: If False, only the mutual information and delay are computed.
+        :param callback: Optional; function called with every emitted result.
+        """
+        if window_length < 2:
+            raise ValueError("window_length must be at least 2")
+
+        if hop_length < 1:
+            raise ValueError("hop_length must be at least 1")
+
+        if maximum_delay >= window_length:
+            raise ValueError("maximum_delay must be smaller than window_length")
+
+        self.window_length = window_length
+        self.hop_length = hop_length
+        self.maximum_delay = maximum_delay
+        self.number_of_partitions = number_of_partitions
+        self.value_range = value_range
+        self.max_embedding_dimension = max_embedding_dimension
+        self.relative_tolerance = relative_tolerance
+        self.absolute_tolerance = absolute_tolerance
+        self.estimate_dimension = estimate_dimension
+        self.callback = callback
+
+        # Ring buffers with the raw samples and their partition indices
+        self._samples = np.zeros(window_length, dtype=np.float64)
+        self._partition_indices = np.zeros(window_length, dtype=np.int64)
+        self._bins_per_axis = number_of_partitions + 1
+        self._tau_values = np.arange(1, maximum_delay + 1)
+        self._joint_counts = np.zeros((maximum_delay, self._bins_per_axis, self._bins_per_axis), dtype=np.int64)
+
+        # Total number of samples seen and samples since the last result
+        self.samples_seen = 0
+        self._samples_since_result = 0
+        self._histograms_ready = False
+
+    def window(self):
+        """
+        Returns the samples of the current window in time order.
+
+        :return: NumPy array with at most window_length samples.
+        """
+        if self.samples_seen < self.window_length:
+            return self._samples[:self.samples_seen].copy()
+
+        return np.roll(self._samples, -(self.samples_seen % self.window_length))
+
+    def _digitize(self, values):
+        """
+        Assigns samples to partitions using the fixed value range.
+        """
+        low, high = self.value_range
+        span = high - low if high > low else 1.0
+
+        return digitize_time_series((np.asarray(values, dtype=np.float64) - low) / span, self.number_of_partitions)
+
+    def _pair_histograms(self, pair_starts, pair_ends, valid_pairs):
+        """
+        Builds the joint histograms of the pairs (pair_starts, pair_ends), one column per
+        delay. Positions are absolute sample numbers; invalid pairs are ignored.
+        """
+        first_bins = self._partition_indices[pair_starts % self.window_length]
+        last_bins = self._partition_indices[pair_ends % self.window_length]
+        pair_codes = (np.arange(self.maximum_delay)[np.newaxis, :] * self._bins_per_axis + first_bins) * self._bins_per_axis + last_bins
+
+        counts = np.bincount(pair_codes[valid_pairs], minlength=self._joint_counts.size)
+
+        return counts.reshape(self._joint_counts.shape)
+
+    def _pairs_starting_at(self, positions, window_end):
+        """
+        Joint histograms of the pairs (p, p + tau) that start at the given positions and
+        end before window_end.
+        """
+        pair_starts = np.broadcast_to(positions[:, np.newaxis], (len(positions), self.maximum_delay))
+        pair_ends = pair_starts + self._tau_values[np.newaxis, :]
+
+        return self._pair_histograms(pair_starts, pair_ends, pair_ends < window_end)
+
+    def _pairs_ending_at(self, positions, window_start):
+        """
+        Joint histograms of the pairs (p - tau, p) that end at the given positions and
+        start at or after window_start.
+        """
+        pair_ends = np.broadcast_to(positions[:, np.newaxis], (len(positions), self.maximum_delay))
+        pair_starts = pair_ends - self._tau_values[np.newaxis, :]
+
+        return self._pair_histograms(pair_starts, pair_ends, pair_starts >= window_start)
+
+    def _rebuild_histograms(self):
+        """
+        Rebins the current window and rebuilds the joint histograms from scratch.
+        """
+        window_start = self.samples_seen - self.window_length
+        positions = np.arange(window_start, self.samples_seen)
+
+        self._partition_indices[positions % self.window_length] = self._digitize(self._samples[positions % self.window_length])
+        self._joint_counts = self._pairs_starting_at(positions, self.samples_seen)
+        self._histograms_ready = True
+
+    def _append(self, values):
+        """
+        Appends at most window_length samples, updating the histograms incrementally.
+        """
+        number_of_values = len(values)
+        first_new = self.samples_seen
+        new_positions = np.arange(first_new, first_new + number_of_values)
+
+        if not self._histograms_ready:
+
+            self._samples[new_positions % self.window_length] = values
+            self.samples_seen += number_of_values
+
+            # Build the histograms once the first window is complete
+            if self.samples_seen >= self.window_length:
+
+                if self.value_range is None:
+                    current_window = self.window()
+                    self.value_range = (np.min(current_window), np.max(current_window))
+
+                self._rebuild_histograms()
+
+            return
+
+        low, high = self.value_range
+
+        # Subtract the pairs that start at the samples about to be evicted
+        old_window_start = first_new - self.window_length
+        evicted_positions = np.arange(old_window_start, old_window_start + number_of_values)
+        self._joint_counts -= self._pairs_starting_at(evicted_positions, first_new)
+
+        # Overwrite the evicted slots with the new samples
+        self._samples[new_positions % self.window_length] = values
+        self.samples_seen += number_of_values
+
+        if np.min(values) < low or np.max(values) > high:
+
+            # Widen the range to the current window and start over
+            current_window = self.window()
+            self.value_range = (min(low, np.min(current_window)), max(high, np.max(current_window)))
+            self._rebuild_histograms()
+
+            return
+
+        # Add the pairs that end at the new samples
+        self._partition_indices[new_positions % self.window_length] = self._digitize(values)
+        self._joint_counts += self._pairs_ending_at(new_positions, self.samples_seen - self.window_length)
+
+    def current_result(self):
+        """
+        Computes the results of the current window from the joint histograms.
+
+        :return: Dictionary with the last sample number, the mutual information values,
+                 the optimal delay, the normalization range and, if enabled, the FNN
+                 values and embedding dimension.
+        """
+        mutual_information_values = mutual_information_from_joint_counts(self._joint_counts, self.number_of_partitions, self.window_length - self._tau_values)
+
+        # Same delay selection as calculate_pim
+        optimal_delay = find_prime_index(mutual_information_values, self.window_length)
+        optimal_delay = optimal_delay if optimal_delay != 0 else self.maximum_delay
+
+        result = {
+            "end_sample": self.samples_seen,
+            "mutual_information": mutual_information_values,
+            "tau": optimal_delay,
+            "value_range": self.value_range,
+        }
+
+        if self.estimate_dimension:
+            fnn_values, estimated_embedding_dimension, dimension_list = knn_dimension_estimation(self.window(), optimal_delay, self.max_embedding_dimension, self.relative_tolerance, self.absolute_tolerance)
+            result["fnn_values"] = fnn_values
+            result["embedding_dimension"] = estimated_embedding_dimension
+
+        return result
+
+    def push(self, chunk):
+        """
+        Feeds a chunk of samples to the analyzer.
+
+        :param chunk: Array-like of new samples, of any length.
+        :return: List of the results emitted while consuming the chunk.
+        """
+        chunk = np.asarray(chunk, dtype=np.float64).ravel()
+        results = []
+        offset = 0
+
+        while offset < len(chunk):
+
+            # Split the chunk at result boundaries and at most one window at a time
+            if self._histograms_ready:
+                piece_length = self.hop_length - self._samples_since_result
+            else:
+                piece_length = self.window_length - self.samples_seen
+
+            piece_length = min(piece_length, self.window_length, len(chunk) - offset)
+            was_ready = self._histograms_ready
+
+            self._append(chunk[offset:offset + piece_length])
+            offset += piece_length
+
+            if was_ready:
+                self._samples_since_result += piece_length
+
+            # Emit the first full window and then every hop_length samples
+            if self._histograms_ready and (not was_ready or self._samples_since_result >= self.hop_length):
+                self._samples_since_result = 0
+                result = self.current_result()
+                results.append(result)
+
+                if self.callback is not None:
+                    self.callback(result)
+
+        return results
+
+def stream_windows(chunks, window_length, hop_length, **analyzer_parameters):
+    """
+    Runs a StreamingAnalyzer over an iterable of sample chunks and yields its results
+    as they are produced.
+
+    :param chunks: Iterable of array-like sample chunks.
+    :param window_length: Number of samples in the analysis window.
+    :param hop_length: Number of new samples between two results.
+    :param analyzer_parameters: Further keyword arguments for StreamingAnalyzer.
+    :return: Generator of result dictionaries.
+    """
+    analyzer = StreamingAnalyzer(window_length, hop_length, **analyzer_parameters)
+
+    for chunk in chunks:
+
+        for result in analyzer.push(chunk):
+            yield result
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Replay a recording through the streaming analyzer.")
+    parser.add_argument("file", help="Recording with 'timestamp : value' lines.")
+    parser.add_argument("--rate", type=float, default=200, help="Sampling rate in Hz (default: 200, as in PPG_V3.ino).")
+    parser.add_argument("--window", type=float, default=20, help="Window length in seconds.")
+    parser.add_argument("--hop", type=float, default=2, help="Seconds between results.")
+    parser.add_argument("--chunk", type=int, default=40, help="Samples per pushed chunk.")
+    parser.add_argument("--taumax", type=int, default=16, help="Maximum delay for the auto mutual information.")
+    parser.add_argument("--partitions", type=int, default=2, help="Number of partitions for the auto mutual information.")
+    arguments = parser.parse_args()
+
+    timestamps, values = load_recording(arguments.file)
+    chunks = (values[start:start + arguments.chunk] for start in range(0, len(values), arguments.chunk))
+
+    for result in stream_windows(chunks, int(arguments.window * arguments.rate), int(arguments.hop * arguments.rate), maximum_delay=arguments.taumax, number_of_partitions=arguments.partitions):
+        print(f"Sample {result['end_sample']} --- Optimal Delay T: {result['tau']} --- Embedding Dimension D: {result['embedding_dimension']}")
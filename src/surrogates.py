@@ -0,0 +1,286 @@
+import os
+import csv
+import sys
+import argparse
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+
+from atractor_v10 import (calculate_auto_mutual_information, calculate_mutual_information_histogram, correlation_dimension,
+                          false_nearest_neighbors_for_dimension, find_recordings, knn_dimension_estimation, largest_lyapunov_exponent,
+                          logarithmic_radii, read_data_from_file)
+import instrumentation
+from instrumentation import instrumented
+
+# Statistics compared against the surrogates and the direction that indicates
+# nonlinear structure: more mutual information, fewer false neighbors and a lower
+# correlation dimension than the surrogates, or a larger Lyapunov exponent
+ALTERNATIVES = {
+    "mutual_information": "greater",
+    "false_nearest_neighbors": "less",
+    "correlation_dimension": "less",
+    "lyapunov_exponent": "greater",
+}
+
+DEFAULT_STATISTICS = ["mutual_information", "false_nearest_neighbors", "correlation_dimension"]
+
+RESULT_FIELDS = ["file", "method", "tau", "embedding_dimension", "number_of_surrogates", "statistic", "value", "surrogate_mean", "surrogate_std", "alternative", "p_value"]
+
+def phase_randomized_surrogates(time_series_data, number_of_surrogates, random_generator):
+    """
+    Generates surrogates with the power spectrum of a series and random Fourier phases.
+    All surrogates come from one batched inverse FFT.
+
+    :param time_series_data: The time series data.
+    :param number_of_surrogates: Number of surrogates.
+    :param random_generator: numpy Generator.
+    :return: Array of shape (number_of_surrogates, len(time_series_data)).
+    """
+    time_series_data = np.asarray(time_series_data, dtype=np.float64)
+    length_of_series = len(time_series_data)
+    mean = np.mean(time_series_data)
+    spectrum = np.fft.rfft(time_series_data - mean)
+
+    # The zero and Nyquist frequencies keep their phase so the surrogates stay real
+    phases = random_generator.uniform(0, 2 * np.pi, (number_of_surrogates, len(spectrum)))
+    phases[:, 0] = 0
+
+    if length_of_series % 2 == 0:
+        phases[:, -1] = 0
+
+    return np.fft.irfft(spectrum * np.exp(1j * phases), n=length_of_series, axis=-1) + mean
+
+def iaaft_surrogates(time_series_data, number_of_surrogates, random_generator, max_iterations=100):
+    """
+    Generates iterative amplitude adjusted Fourier transform (IAAFT) surrogates, which
+    keep both the amplitude distribution and, approximately, the power spectrum of a
+    series. Every iteration adjusts all surrogates at once with batched FFTs, until the
+    rank order of every surrogate stops changing or max_iterations is reached.
+
+    :param time_series_data: The time series data.
+    :param number_of_surrogates: Number of surrogates.
+    :param random_generator: numpy Generator.
+    :param max_iterations: Maximum number of spectrum/amplitude adjustments.
+    :return: Array of shape (number_of_surrogates, len(time_series_data)).
+    """
+    time_series_data = np.asarray(time_series_data, dtype=np.float64)
+    length_of_series = len(time_series_data)
+    sorted_values = np.sort(time_series_data)
+    amplitudes = np.abs(np.fft.rfft(time_series_data))
+
+    # Start from random shuffles of the series
+    order = np.argsort(random_generator.random((number_of_surrogates, length_of_series)), axis=1)
+    surrogates = np.empty((number_of_surrogates, length_of_series))
+    np.put_along_axis(surrogates, order, sorted_values[np.newaxis, :], axis=1)
+
+    for _ in range(max_iterations):
+
+        # Impose the power spectrum, then give the k-th smallest sample the k-th smallest value
+        spectra = np.fft.rfft(surrogates, axis=-1)
+        surrogates = np.fft.irfft(amplitudes * np.exp(1j * np.angle(spectra)), n=length_of_series, axis=-1)
+        new_order = np.argsort(surrogates, axis=1)
+        np.put_along_axis(surrogates, new_order, sorted_values[np.newaxis, :], axis=1)
+
+        if np.array_equal(new_order, order):
+            break
+
+        order = new_order
+
+    return surrogates
+
+SURROGATE_METHODS = {
+    "phase": phase_randomized_surrogates,
+    "iaaft": iaaft_surrogates,
+}
+
+def evaluate_statistics(series_batch, delay, embedding_dimension, statistic_names, number_of_partitions, relative_tolerance, absolute_tolerance, radius_values):
+    """
+    Evaluates the test statistics on a batch of series with the embedding of the
+    original series. Also the worker entry point of surrogate_test.
+
+    :param series_batch: Array of shape (series, samples).
+    :param delay: Delay of the embedding.
+    :param embedding_dimension: Dimension of the embedding.
+    :param statistic_names: Names of the statistics (see ALTERNATIVES).
+    :param number_of_partitions: Number of partitions of the mutual information.
+    :param relative_tolerance: The relative tolerance for false nearest neighbors.
+    :param absolute_tolerance: The absolute tolerance for false nearest neighbors.
+    :param radius_values: Radii of the correlation sums, shared by all series.
+    :return: Array of shape (series, statistics).
+    """
+    values = np.empty((len(series_batch), len(statistic_names)))
+
+    for series_index, time_series_data in enumerate(series_batch):
+
+        for statistic_index, statistic_name in enumerate(statistic_names):
+
+            if statistic_name == "mutual_information":
+                normalized_time_series = (time_series_data - np.min(time_series_data)) / (np.max(time_series_data) - np.min(time_series_data))
+                value = calculate_mutual_information_histogram(normalized_time_series, [delay], number_of_partitions, len(normalized_time_series))[0]
+            elif statistic_name == "false_nearest_neighbors":
+                value = false_nearest_neighbors_for_dimension(time_series_data, delay, embedding_dimension, relative_tolerance, absolute_tolerance)
+            elif statistic_name == "correlation_dimension":
+                # Least squares keeps the statistic deterministic across series
+                value = correlation_dimension(time_series_data, embedding_dimension, delay, radius_values, fit="poly")
+            elif statistic_name == "lyapunov_exponent":
+                value = largest_lyapunov_exponent(time_series_data, embedding_dimension, delay, fit="poly")
+            else:
+                raise ValueError(f"Unknown surrogate statistic: {statistic_name}")
+
+            values[series_index, statistic_index] = value
+
+    return values
+
+def rank_p_value(value, surrogate_values, alternative):
+    """
+    One-sided rank p-value of a statistic against its surrogate distribution.
+
+    :param value: Statistic of the original series.
+    :param surrogate_values: Statistics of the surrogates.
+    :param alternative: 'greater' or 'less', the direction of nonlinear structure.
+    :return: (1 + number of surrogates at least as extreme) / (number of surrogates + 1).
+             Surrogates whose statistic could not be computed count as extreme.
+    """
+    surrogate_values = np.asarray(surrogate_values, dtype=np.float64)
+
+    with np.errstate(invalid="ignore"):
+        if alternative == "greater":
+            at_least_as_extreme = ~(surrogate_values < value)
+        else:
+            at_least_as_extreme = ~(surrogate_values > value)
+
+    return float((1 + np.count_nonzero(at_least_as_extreme)) / (len(surrogate_values) + 1))
+
+@instrumented
+def surrogate_test(time_series_data, delay, embedding_dimension, number_of_surrogates=39, method="iaaft", statistic_names=DEFAULT_STATISTICS,
+                   number_of_partitions=2, relative_tolerance=10, absolute_tolerance=2, jobs=None, seed=0):
+    """
+    Tests a series for nonlinear structure against surrogates. The surrogates are
+    generated in one batch, and the statistics of the original series and of every
+    surrogate are evaluated with the same embedding on a process pool.
+
+    :param time_series_data: The time series data.
+    :param delay: Delay of the embedding, e.g. from calculate_auto_mutual_information.
+    :param embedding_dimension: Dimension of the embedding, e.g. from knn_dimension_estimation.
+    :param number_of_surrogates: Number of surrogates; 39 allows p = 0.025.
+    :param method: 'iaaft' or 'phase' (see SURROGATE_METHODS).
+    :param statistic_names: Names of the statistics (see ALTERNATIVES).
+    :param number_of_partitions: Number of partitions of the mutual information.
+    :param relative_tolerance: The relative tolerance for false nearest neighbors.
+    :param absolute_tolerance: The absolute tolerance for false nearest neighbors.
+    :param jobs: Number of worker processes, defaults to the number of CPUs; 1 runs in
+                 this process.
+    :param seed: Seed of the surrogate generator.
+    :return: Dictionary mapping each statistic to a dictionary with the original value,
+             the surrogate values, the alternative and the p-value.
+    """
+    if method not in SURROGATE_METHODS:
+        raise ValueError(f"Unknown surrogate method: {method}")
+
+    time_series_data = np.asarray(time_series_data, dtype=np.float64)
+    surrogates = SURROGATE_METHODS[method](time_series_data, number_of_surrogates, np.random.default_rng(seed))
+    series_batch = np.vstack((time_series_data, surrogates))
+
+    # Fixed radii, so every correlation sum is taken at the same scales
+    standard_deviation_of_data = np.std(time_series_data, ddof=1)
+    radius_values = logarithmic_radii(0.1 * standard_deviation_of_data, 0.5 * standard_deviation_of_data, 1.03)
+    arguments = (delay, embedding_dimension, statistic_names, number_of_partitions, relative_tolerance, absolute_tolerance, radius_values)
+
+    if jobs is None:
+        jobs = os.cpu_count() or 1
+
+    if jobs == 1:
+        values = evaluate_statistics(series_batch, *arguments)
+    else:
+
+        # A few batches per worker balance the load without pickling every series separately
+        batches = np.array_split(series_batch, min(len(series_batch), jobs * 4))
+
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            values = np.vstack(list(executor.map(evaluate_statistics, batches, *[[argument] * len(batches) for argument in arguments])))
+
+    results = {}
+
+    for statistic_index, statistic_name in enumerate(statistic_names):
+        value = values[0, statistic_index]
+        surrogate_values = values[1:, statistic_index]
+        results[statistic_name] = {
+            "value": float(value),
+            "surrogate_values": surrogate_values.tolist(),
+            "alternative": ALTERNATIVES[statistic_name],
+            "p_value": rank_p_value(value, surrogate_values, ALTERNATIVES[statistic_name]),
+        }
+
+    return results
+
+def test_recording(data_file_path, number_of_surrogates=39, method="iaaft", statistic_names=DEFAULT_STATISTICS, max_delay_taumax=16, num_partitions=2,
+                   max_embedding_dimension=10, relative_tolerance=10, absolute_tolerance=2, jobs=None, seed=0):
+    """
+    Selects the embedding of a recording as analyze_recording does and runs the
+    surrogate test with it.
+
+    :param data_file_path: Path to the recording.
+    :return: List of result dictionaries with the RESULT_FIELDS, one per statistic.
+    """
+    with instrumentation.recording(data_file_path):
+        time_series_data = read_data_from_file(data_file_path)
+        _, optimal_delay = calculate_auto_mutual_information(time_series_data, max_delay_taumax, num_partitions)
+        _, estimated_embedding_dimension, _ = knn_dimension_estimation(time_series_data, optimal_delay, max_embedding_dimension, relative_tolerance, absolute_tolerance)
+
+        results = surrogate_test(time_series_data, optimal_delay, estimated_embedding_dimension, number_of_surrogates, method, statistic_names,
+                                 num_partitions, relative_tolerance, absolute_tolerance, jobs, seed)
+
+    rows = []
+
+    for statistic_name, result in results.items():
+        surrogate_values = np.asarray(result["surrogate_values"])
+        rows.append({
+            "file": data_file_path,
+            "method": method,
+            "tau": int(optimal_delay),
+            "embedding_dimension": int(estimated_embedding_dimension),
+            "number_of_surrogates": number_of_surrogates,
+            "statistic": statistic_name,
+            "value": result["value"],
+            "surrogate_mean": float(np.nanmean(surrogate_values)),
+            "surrogate_std": float(np.nanstd(surrogate_values)),
+            "alternative": result["alternative"],
+            "p_value": result["p_value"],
+        })
+
+    return rows
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Test ECG/PPG recordings for nonlinear structure against phase-randomized or IAAFT surrogates.")
+    parser.add_argument("paths", nargs="*", default=["Data"], help="Recordings or data directories (default: Data).")
+    parser.add_argument("--output", default="surrogate_tests.csv", help="CSV table with one row per recording and statistic (default: surrogate_tests.csv).")
+    parser.add_argument("--surrogates", type=int, default=39, help="Number of surrogates per recording (default: 39).")
+    parser.add_argument("--method", choices=list(SURROGATE_METHODS), default="iaaft", help="Surrogate method (default: iaaft).")
+    parser.add_argument("--statistics", nargs="+", choices=list(ALTERNATIVES), default=DEFAULT_STATISTICS, help="Statistics to test.")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count(), help="Number of worker processes.")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the surrogate generator.")
+    arguments = parser.parse_args()
+
+    recordings = [recording for path in arguments.paths for recording in (find_recordings(path) if os.path.isdir(path) else [path])]
+    failed = 0
+
+    with open(arguments.output, "w", newline="") as output_file:
+        writer = csv.DictWriter(output_file, fieldnames=RESULT_FIELDS)
+        writer.writeheader()
+
+        for data_file_path in recordings:
+
+            try:
+                rows = test_recording(data_file_path, arguments.surrogates, arguments.method, arguments.statistics, jobs=arguments.jobs, seed=arguments.seed)
+            except Exception as error:
+                print(f"{data_file_path} --- failed: {error}", file=sys.stderr)
+                failed += 1
+                continue
+
+            writer.writerows(rows)
+            output_file.flush()
+
+            for row in rows:
+                print(f"{os.path.basename(data_file_path).split('.')[0]} --- {row['statistic']}: {row['value']:.4f} (surrogates {row['surrogate_mean']:.4f} +/- {row['surrogate_std']:.4f}) p = {row['p_value']:.3f}")
+
+    sys.exit(1 if failed else 0)
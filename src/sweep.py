@@ -0,0 +1,293 @@
+import os
+import csv
+import sys
+import argparse
+import itertools
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from atractor_v10 import (CORRELATION_REFERENCE_POINTS, FALSE_NEIGHBORS_THRESHOLD, RANSAC_RANDOM_STATE, calculate_false_nearest_neighbors,
+                          calculate_mutual_information_histogram, correlation_dimension, find_prime_index, find_recordings, hurst_exponent,
+                          largest_lyapunov_exponent, nearest_neighbor_query, phase_space_reconstruction, read_data_from_file, run_stage)
+from batch import MANIFEST_FIELDS, PARAMETER_FIELDS, worker_cache
+from stage_cache import fingerprint_samples
+import instrumentation
+
+# Defaults of analyze_recording, used for the parameters missing from a grid
+DEFAULT_PARAMETERS = {
+    "max_delay_taumax": 16,
+    "num_partitions": 2,
+    "max_embedding_dimension": 10,
+    "relative_tolerance": 10,
+    "absolute_tolerance": 2,
+}
+
+def expand_grid(grid):
+    """
+    Lists the points of a parameter grid.
+
+    :param grid: Dictionary mapping parameter names (see PARAMETER_FIELDS) to lists of
+                 values. Missing parameters take their analyze_recording default.
+    :return: List of dictionaries, one per combination of values.
+    """
+    unknown = set(grid) - set(PARAMETER_FIELDS)
+
+    if unknown:
+        raise ValueError(f"Unknown sweep parameters: {', '.join(sorted(unknown))}")
+
+    values = [list(grid.get(field, [DEFAULT_PARAMETERS[field]])) for field in PARAMETER_FIELDS]
+
+    return [dict(zip(PARAMETER_FIELDS, point)) for point in itertools.product(*values)]
+
+class RecordingSweep:
+    """
+    Shares the work of many analyze_recording runs on one recording. The series is
+    normalized once, binned once per partition count and its mutual information is
+    computed once up to the largest maximum delay; smaller maximum delays use a prefix
+    of the same curve. The nearest neighbors of each (delay, dimension) embedding are
+    queried once and reused for every tolerance pair, and the complexity measures are
+    computed once per distinct (dimension, delay). Every grid point gets the results
+    analyze_recording would return for it.
+    """
+
+    def __init__(self, time_series_data, cache=None):
+        """
+        :param time_series_data: The time series data.
+        :param cache: Optional; StageCache shared with analyze_recording for the
+                      complexity measures.
+        """
+        self.time_series_data = np.asarray(time_series_data)
+        self.standard_deviation_of_data = np.std(self.time_series_data)
+        self.cache = cache
+        self.samples_fingerprint = fingerprint_samples(self.time_series_data) if cache is not None else None
+
+        # Normalization does not depend on any parameter
+        minimum = np.min(self.time_series_data)
+        self.normalized_time_series = (self.time_series_data - minimum) / (np.max(self.time_series_data) - minimum)
+
+        self._mutual_information = {}
+        self._neighbors = {}
+        self._complexity = {}
+        self._hurst_exponent = None
+
+    def mutual_information(self, number_of_partitions, maximum_delay):
+        """
+        Returns the auto mutual information for delays 1 to maximum_delay, extending the
+        cached curve of the partition count only when a larger delay is requested.
+
+        :param number_of_partitions: The number of partitions.
+        :param maximum_delay: The maximum delay.
+        :return: List of mutual information values.
+        """
+        values = self._mutual_information.get(number_of_partitions, [])
+
+        if len(values) < maximum_delay:
+            values = values + calculate_mutual_information_histogram(self.normalized_time_series, range(len(values) + 1, maximum_delay + 1),
+                                                                     number_of_partitions, len(self.normalized_time_series))
+            self._mutual_information[number_of_partitions] = values
+
+        return values[:maximum_delay]
+
+    def optimal_delay(self, number_of_partitions, maximum_delay):
+        """
+        Selects the delay as calculate_pim does.
+
+        :param number_of_partitions: The number of partitions.
+        :param maximum_delay: The maximum delay.
+        :return: Tuple containing the mutual information values and the optimal delay.
+        """
+        pim_values = self.mutual_information(number_of_partitions, maximum_delay)
+        optimal_tau_value = find_prime_index(pim_values, len(self.normalized_time_series))
+
+        return pim_values, optimal_tau_value if optimal_tau_value != 0 else maximum_delay
+
+    def neighbors(self, delay, embedding_dimension):
+        """
+        Returns the nearest neighbors of an embedding, querying them on first use.
+
+        :param delay: The delay of the reconstruction.
+        :param embedding_dimension: The embedding dimension of the reconstruction.
+        :return: Tuple containing the distances and indices arrays.
+        """
+        key = (delay, embedding_dimension)
+
+        if key not in self._neighbors:
+            reconstructed_data = phase_space_reconstruction(self.time_series_data, embedding_dimension, delay, copy=False)
+            self._neighbors[key] = nearest_neighbor_query(reconstructed_data)
+
+        return self._neighbors[key]
+
+    def embedding_dimension(self, delay, max_embedding_dimension, relative_tolerance, absolute_tolerance):
+        """
+        Estimates the embedding dimension as knn_dimension_estimation does, from the
+        shared neighbor queries.
+
+        :param delay: The delay of the reconstruction.
+        :param max_embedding_dimension: The maximum embedding dimension to consider.
+        :param relative_tolerance: The relative tolerance for nearest neighbor search.
+        :param absolute_tolerance: The absolute tolerance for nearest neighbor search.
+        :return: Tuple containing the FNN array and the estimated embedding dimension.
+        """
+        fnn_values = np.zeros(max_embedding_dimension)
+
+        for current_dimension in range(1, max_embedding_dimension + 1):
+            distances, indices = self.neighbors(delay, current_dimension)
+            fnn_values[current_dimension - 1] = calculate_false_nearest_neighbors(self.time_series_data, distances, indices, current_dimension, delay,
+                                                                                  relative_tolerance, absolute_tolerance, self.standard_deviation_of_data)
+
+            # Dimensions past the first accepted one are never queried
+            if fnn_values[current_dimension - 1] < FALSE_NEIGHBORS_THRESHOLD:
+                return fnn_values, current_dimension
+
+        return fnn_values, np.argmin(fnn_values) + 1
+
+    def complexity_measures(self, embedding_dimension, delay):
+        """
+        Computes the correlation dimension and the largest Lyapunov exponent of an
+        embedding once.
+
+        :param embedding_dimension: The embedding dimension.
+        :param delay: The delay.
+        :return: Tuple containing the correlation dimension and the Lyapunov exponent.
+        """
+        key = (embedding_dimension, delay)
+
+        if key not in self._complexity:
+
+            # Same stage keys as analyze_recording, so both share cached results
+            embedding_parameters = {"embedding_dimension": embedding_dimension, "delay": delay, "random_state": RANSAC_RANDOM_STATE}
+            correlation_dim = run_stage(self.cache, "correlation_dimension", self.samples_fingerprint, dict(embedding_parameters, max_reference_points=CORRELATION_REFERENCE_POINTS),
+                lambda: correlation_dimension(self.time_series_data, embedding_dimension, delay, random_state=RANSAC_RANDOM_STATE))
+            lyapunov_exp = run_stage(self.cache, "lyapunov_exponent", self.samples_fingerprint, embedding_parameters,
+                lambda: largest_lyapunov_exponent(self.time_series_data, embedding_dimension, delay, random_state=RANSAC_RANDOM_STATE))
+            self._complexity[key] = (float(correlation_dim), float(lyapunov_exp))
+
+        return self._complexity[key]
+
+    def hurst_exponent(self):
+        """
+        :return: The Hurst exponent, which depends on no parameter.
+        """
+        if self._hurst_exponent is None:
+            self._hurst_exponent = float(run_stage(self.cache, "hurst_exponent", self.samples_fingerprint, {"random_state": RANSAC_RANDOM_STATE},
+                lambda: hurst_exponent(self.time_series_data, RANSAC_RANDOM_STATE)))
+
+        return self._hurst_exponent
+
+    def run(self, grid_points, complexity=True):
+        """
+        Evaluates every grid point.
+
+        :param grid_points: List of parameter dictionaries (see expand_grid).
+        :param complexity: If False, only the delay and embedding dimension are computed.
+        :return: List of result dictionaries, one per grid point, in grid order.
+        """
+        rows = []
+
+        for parameters in grid_points:
+            _, optimal_delay = self.optimal_delay(parameters["num_partitions"], parameters["max_delay_taumax"])
+            _, estimated_embedding_dimension = self.embedding_dimension(optimal_delay, parameters["max_embedding_dimension"],
+                                                                        parameters["relative_tolerance"], parameters["absolute_tolerance"])
+
+            row = dict(parameters)
+            row["tau"] = int(optimal_delay)
+            row["embedding_dimension"] = int(estimated_embedding_dimension)
+
+            if complexity:
+                row["correlation_dimension"], row["lyapunov_exponent"] = self.complexity_measures(estimated_embedding_dimension, optimal_delay)
+                row["hurst_exponent"] = self.hurst_exponent()
+
+            rows.append(row)
+
+        return rows
+
+def sweep_recording(file_path, grid_points, complexity=True, cache_directory=None, cache_bytes=512 * 1024 * 1024):
+    """
+    Runs a parameter sweep on one recording. Also the worker entry point of sweep.
+
+    :param file_path: Path to the recording.
+    :param grid_points: List of parameter dictionaries (see expand_grid).
+    :param complexity: If False, only the delay and embedding dimension are computed.
+    :param cache_directory: Optional; directory of a StageCache for the complexity measures.
+    :param cache_bytes: Size cap of the StageCache in bytes.
+    :return: List of result dictionaries with the 'file' field, one per grid point.
+    """
+    cache = worker_cache(cache_directory, cache_bytes)
+
+    with instrumentation.recording(file_path), instrumentation.stage("sweep_recording"):
+        rows = RecordingSweep(read_data_from_file(file_path), cache).run(grid_points, complexity)
+
+    for row in rows:
+        row["file"] = file_path
+
+    return rows
+
+def sweep(recordings, grid, jobs=None, complexity=True, cache_directory=None, cache_bytes=512 * 1024 * 1024):
+    """
+    Evaluates a parameter grid on a set of recordings, one recording per worker process.
+
+    :param recordings: List of recording paths.
+    :param grid: Dictionary mapping parameter names to lists of values (see expand_grid).
+    :param jobs: Number of worker processes, defaults to the number of CPUs.
+    :param complexity: If False, only the delay and embedding dimension are computed.
+    :param cache_directory: Optional; directory of a StageCache for the complexity measures.
+    :param cache_bytes: Size cap of the StageCache in bytes.
+    :return: Tuple containing the tidy table (list of dictionaries with the MANIFEST_FIELDS,
+             one per recording and grid point, in input order) and the list of
+             (recording, error) pairs that failed.
+    """
+    grid_points = expand_grid(grid)
+    rows_by_recording = {}
+    failures = []
+
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures = {executor.submit(sweep_recording, file_path, grid_points, complexity, cache_directory, cache_bytes): file_path for file_path in recordings}
+
+        for future in as_completed(futures):
+            file_path = futures[future]
+
+            try:
+                rows_by_recording[file_path] = future.result()
+            except Exception as error:
+                failures.append((file_path, error))
+
+    table = [row for file_path in recordings if file_path in rows_by_recording for row in rows_by_recording[file_path]]
+
+    return table, failures
+
+def write_table(table, output_path):
+    """
+    Writes a sweep table to a CSV file.
+
+    :param table: List of result dictionaries.
+    :param output_path: Path to the CSV file.
+    """
+    with open(output_path, "w", newline="") as output_file:
+        writer = csv.DictWriter(output_file, fieldnames=MANIFEST_FIELDS, extrasaction="ignore")
+        writer.writeheader()
+        writer.writerows(table)
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Evaluate a grid of analysis parameters on every ECG/PPG recording, sharing the work between grid points.")
+    parser.add_argument("data_directory", nargs="?", default="Data", help="Root of the data tree (default: Data).")
+    parser.add_argument("--output", default="sweep.csv", help="CSV table with one row per recording and grid point (default: sweep.csv).")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count(), help="Number of worker processes.")
+    parser.add_argument("--taumax", dest="max_delay_taumax", type=int, nargs="+", default=[16], help="Maximum delays for the auto mutual information.")
+    parser.add_argument("--partitions", dest="num_partitions", type=int, nargs="+", default=[2], help="Numbers of partitions for the auto mutual information.")
+    parser.add_argument("--max-dimension", dest="max_embedding_dimension", type=int, nargs="+", default=[10], help="Maximum embedding dimensions for FNN.")
+    parser.add_argument("--rtol", dest="relative_tolerance", type=float, nargs="+", default=[10], help="Relative tolerances for FNN.")
+    parser.add_argument("--atol", dest="absolute_tolerance", type=float, nargs="+", default=[2], help="Absolute tolerances for FNN.")
+    parser.add_argument("--no-complexity", action="store_true", help="Only select the delay and embedding dimension.")
+    parser.add_argument("--cache", default=None, help="Directory of the stage result cache shared with batch.py.")
+    arguments = parser.parse_args()
+
+    grid = {field: getattr(arguments, field) for field in PARAMETER_FIELDS}
+    table, failures = sweep(find_recordings(arguments.data_directory), grid, arguments.jobs, not arguments.no_complexity, arguments.cache)
+    write_table(table, arguments.output)
+
+    for file_path, error in failures:
+        print(f"{file_path} --- failed: {error}", file=sys.stderr)
+
+    print(f"{len(table)} rows from {len(expand_grid(grid))} grid points written to {arguments.output}")
+    sys.exit(1 if failures else 0)